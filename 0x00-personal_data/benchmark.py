@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""A module for benchmarking the redaction and hashing paths.
+"""
+import sys
+import json
+import time
+import random
+import string
+import logging
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from typing import Callable, Dict, List, Sequence, Tuple
+from filtered_logger import (
+    BACKENDS,
+    PII_FIELDS,
+    RedactingFormatter,
+    filter_datum,
+    get_engine,
+)
+from encrypt_password import (
+    hash_password,
+    hash_password_many,
+    is_valid,
+    is_valid_many,
+    set_cost,
+)
+
+
+PLAIN_FIELDS = ("ip", "last_login", "user_agent", "request_id", "path")
+
+
+def field_names(count: int, seed: int = 0) -> List[str]:
+    """Returns PII_FIELDS padded with random field names up to count."""
+    rnd = random.Random(seed)
+    names = list(PII_FIELDS[:count])
+    seen = set(names)
+    while len(names) < count:
+        name = "".join(rnd.choices(string.ascii_lowercase + "_", k=10))
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def log_items(
+    fields: Sequence[str],
+    lines: int,
+    pairs: int = 8,
+    density: float = 0.5,
+    value_size: int = 12,
+    seed: int = 0,
+) -> List[List[Tuple[str, str]]]:
+    """Generates lines of (key, value) pairs, density of them PII."""
+    rnd = random.Random(seed)
+    result = []
+    for _ in range(lines):
+        items = []
+        for _ in range(pairs):
+            pool = fields if rnd.random() < density else PLAIN_FIELDS
+            value = "".join(rnd.choices(string.ascii_letters, k=value_size))
+            items.append((rnd.choice(pool), value))
+        result.append(items)
+    return result
+
+
+def log_lines(
+    fields: Sequence[str],
+    lines: int,
+    pairs: int = 8,
+    density: float = 0.5,
+    value_size: int = 12,
+    seed: int = 0,
+) -> List[str]:
+    """Generates `key=value;` lines, density of the keys being PII."""
+    return [
+        "{};".format(";".join("{}={}".format(*item) for item in items))
+        for items in log_items(fields, lines, pairs, density, value_size, seed)
+    ]
+
+
+def measure(name: str, func: Callable, inputs: Sequence) -> Dict:
+    """Times func over inputs, then reruns it to trace its allocations."""
+    latencies = []
+    clock = time.perf_counter_ns
+    for value in inputs:
+        start = clock()
+        func(value)
+        latencies.append(clock() - start)
+    tracemalloc.start()
+    for value in inputs:
+        func(value)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies.sort()
+    total = sum(latencies) or 1
+    p99 = min(len(latencies) - 1, len(latencies) * 99 // 100)
+    return {
+        "name": name,
+        "count": len(inputs),
+        "per_sec": len(inputs) * 1e9 / total,
+        "p50_us": latencies[len(latencies) // 2] / 1000,
+        "p99_us": latencies[p99] / 1000,
+        "retained_bytes": allocated,
+        "peak_bytes": peak,
+    }
+
+
+def records(
+    items: List[List[Tuple[str, str]]],
+    structured: bool,
+) -> List[logging.LogRecord]:
+    """Builds text or structured LogRecords from generated lines."""
+    result = []
+    for pairs in items:
+        msg = "; ".join("{}={}".format(*pair) for pair in pairs) + ";"
+        args = ("user_data", logging.INFO, None, None, msg, None, None)
+        record = logging.LogRecord(*args)
+        if structured:
+            record.msg = ""
+            record.user_data = dict(pairs)
+        result.append(record)
+    return result
+
+
+def bench_redaction(
+    fields: Sequence[str],
+    items: List[List[Tuple[str, str]]],
+) -> List[Dict]:
+    """Measures every redaction backend and formatter path."""
+    lines = [
+        "{};".format(";".join("{}={}".format(*pair) for pair in pairs))
+        for pairs in items
+    ]
+    results = [measure(
+        "filter_datum",
+        lambda line: filter_datum(fields, "***", line, ";"),
+        lines,
+    )]
+    for backend in BACKENDS:
+        engine = get_engine(fields, ";", "***", backend)
+        results.append(measure(
+            "engine[{}]".format(backend), engine.redact, lines
+        ))
+        formatter = RedactingFormatter(fields, backend)
+        results.append(measure(
+            "format[{}]".format(backend),
+            formatter.format,
+            records(items, False),
+        ))
+    for output in ("text", "json"):
+        formatter = RedactingFormatter(fields, output=output)
+        results.append(measure(
+            "format[structured-{}]".format(output),
+            formatter.format,
+            records(items, True),
+        ))
+    return results
+
+
+def bench_bcrypt(costs: Sequence[int], rounds: int) -> List[Dict]:
+    """Measures hashing and checking passwords at several costs.
+
+    Each cost is pinned with set_cost, so the public single and batch
+    APIs are timed as callers use them; a batch counts as one call.
+    """
+    results = []
+    passwords = ["password-{}".format(i) for i in range(rounds)]
+    previous = set_cost(None)
+    try:
+        for cost in costs:
+            set_cost(cost)
+            hashes = hash_password_many(passwords)
+            pairs = list(zip(hashes, passwords))
+            results.append(measure(
+                "hash_password[cost={}]".format(cost),
+                hash_password,
+                passwords,
+            ))
+            results.append(measure(
+                "hash_password_many[cost={}]".format(cost),
+                hash_password_many,
+                [passwords],
+            ))
+            results.append(measure(
+                "is_valid[cost={}]".format(cost),
+                lambda pair: is_valid(*pair),
+                pairs,
+            ))
+            results.append(measure(
+                "is_valid_many[cost={}]".format(cost),
+                is_valid_many,
+                [pairs],
+            ))
+    finally:
+        set_cost(previous)
+    return results
+
+
+def bench_scaling(
+    counts: Sequence[int] = (5, 50, 200, 1000),
+    lines: int = 2000,
+) -> Dict[str, Dict[int, float]]:
+    """Measures lines/sec of every backend as the field count grows."""
+    results = {backend: {} for backend in BACKENDS}
+    for count in counts:
+        fields = field_names(count)
+        messages = log_lines(fields, lines)
+        for backend in BACKENDS:
+            engine = get_engine(fields, ";", "***", backend)
+            start = time.perf_counter()
+            for message in messages:
+                engine.redact(message)
+            elapsed = time.perf_counter() - start
+            results[backend][count] = lines / elapsed
+    return results
+
+
+def git_commit() -> str:
+    """Returns the commit being benchmarked, if known."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """Parses the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--pairs", type=int, default=8,
+                        help="key=value pairs per line")
+    parser.add_argument("--value-size", type=int, default=12)
+    parser.add_argument("--fields", type=int, default=len(PII_FIELDS),
+                        help="number of fields to redact")
+    parser.add_argument("--density", type=float, default=0.5,
+                        help="share of keys that are redacted fields")
+    parser.add_argument("--costs", default="4,8,10,12",
+                        help="comma separated bcrypt costs, empty to skip")
+    parser.add_argument("--rounds", type=int, default=5,
+                        help="passwords hashed per bcrypt cost")
+    parser.add_argument("--scaling", action="store_true",
+                        help="print lines/sec per backend by field count")
+    parser.add_argument("--json", metavar="PATH",
+                        help="write results as JSON ('-' for stdout)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    """Runs the benchmarks and prints or saves their results."""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.scaling:
+        counts = (5, 50, 200, 1000)
+        results = bench_scaling(counts, args.lines)
+        print("{:>8}".format("fields") + "".join(
+            "{:>16}".format(backend) for backend in results
+        ))
+        for count in counts:
+            print("{:>8}".format(count) + "".join(
+                "{:>16.0f}".format(results[backend][count])
+                for backend in results
+            ))
+        return
+    fields = field_names(args.fields, args.seed)
+    items = log_items(
+        fields,
+        args.lines,
+        args.pairs,
+        args.density,
+        args.value_size,
+        args.seed,
+    )
+    costs = [int(cost) for cost in args.costs.split(",") if cost]
+    results = bench_redaction(fields, items) + bench_bcrypt(costs, args.rounds)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": vars(args),
+        "results": results,
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    print("{:<28}{:>12}{:>10}{:>10}{:>12}".format(
+        "benchmark", "per sec", "p50 us", "p99 us", "peak KiB"
+    ))
+    for result in results:
+        print("{:<28}{:>12.0f}{:>10.1f}{:>10.1f}{:>12.1f}".format(
+            result["name"],
+            result["per_sec"],
+            result["p50_us"],
+            result["p99_us"],
+            result["peak_bytes"] / 1024,
+        ))
+
+
+if __name__ == "__main__":
+    main()
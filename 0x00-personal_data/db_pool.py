@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""A module for pooling database connections.
+"""
+import time
+import queue
+import sqlite3
+import threading
+from typing import Any, Sequence
+
+
+USERS_SCHEMA = """CREATE TABLE IF NOT EXISTS users (
+    name VARCHAR(256),
+    email VARCHAR(256),
+    phone VARCHAR(16),
+    ssn VARCHAR(16),
+    password VARCHAR(256),
+    ip VARCHAR(64),
+    last_login TIMESTAMP,
+    user_agent VARCHAR(512)
+);"""
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available in time."""
+
+
+class MySQLBackend:
+    """Opens connections to a MySQL server."""
+
+    def __init__(self, **options: Any):
+        self.options = options
+
+    def connect(self):
+        """Opens a new connection."""
+        import mysql.connector
+
+        return mysql.connector.connect(**self.options)
+
+    def ping(self, connection) -> bool:
+        """Checks that a connection is still usable."""
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+
+class SQLiteCursor:
+    """A sqlite3 cursor speaking the mysql.connector dialect used here."""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self.cursor, name)
+
+    def execute(self, query: str, params: Sequence = ()):
+        """Runs a query written with %s placeholders."""
+        return self.cursor.execute(query.replace("%s", "?"), params)
+
+
+class SQLiteConnection:
+    """A sqlite3 connection handing out SQLiteCursor objects."""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __getattr__(self, name: str):
+        return getattr(self.connection, name)
+
+    def cursor(self, **kwargs: Any) -> SQLiteCursor:
+        """Opens a cursor, ignoring mysql.connector cursor options."""
+        return SQLiteCursor(self.connection.cursor())
+
+
+class SQLiteBackend:
+    """Opens connections to a local SQLite stand-in of the users table."""
+
+    MEMORY = "file:personal_data?mode=memory&cache=shared"
+
+    def __init__(self, database: str = ""):
+        self.database = database or self.MEMORY
+
+    def connect(self) -> SQLiteConnection:
+        """Opens a new connection, creating the users table if needed."""
+        connection = sqlite3.connect(
+            self.database, uri=True, check_same_thread=False
+        )
+        connection.execute(USERS_SCHEMA)
+        connection.commit()
+        return SQLiteConnection(connection)
+
+    def ping(self, connection: SQLiteConnection) -> bool:
+        """Checks that a connection is still usable."""
+        try:
+            connection.execute("SELECT 1;")
+            return True
+        except sqlite3.Error:
+            return False
+
+
+class PooledConnection:
+    """A checked out connection that returns to its pool on close."""
+
+    def __init__(self, pool: "ConnectionPool", connection, created: float):
+        self._pool = pool
+        self._connection = connection
+        self._created = created
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getattr__(self, name: str):
+        if self._connection is None:
+            raise AttributeError("connection already returned to its pool")
+        return getattr(self._connection, name)
+
+    def close(self):
+        """Returns the connection to its pool."""
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool.release(connection, self._created)
+
+
+class ConnectionPool:
+    """A bounded pool of reusable database connections."""
+
+    def __init__(
+        self,
+        backend,
+        size: int = 5,
+        timeout: float = 30.0,
+        recycle: float = 3600.0,
+        pre_ping: bool = True,
+    ):
+        self.backend = backend
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self) -> PooledConnection:
+        """Checks out a healthy connection, opening one if needed."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout("no connection available")
+        try:
+            connection, created = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        return PooledConnection(self, connection, created)
+
+    def _checkout(self) -> tuple:
+        """Returns an idle connection still fit for use, or a new one."""
+        while True:
+            try:
+                connection, created = self._idle.get_nowait()
+            except queue.Empty:
+                return self.backend.connect(), time.monotonic()
+            expired = time.monotonic() - created > self.recycle
+            if not expired and (
+                not self.pre_ping or self.backend.ping(connection)
+            ):
+                return connection, created
+            self._discard(connection)
+
+    def release(self, connection, created: float):
+        """Takes a connection back into the pool."""
+        try:
+            connection.rollback()
+            self._idle.put((connection, created))
+        except Exception:
+            self._discard(connection)
+        finally:
+            self._slots.release()
+
+    def _discard(self, connection):
+        """Closes a connection that will not be reused."""
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Closes every idle connection."""
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
@@ -1,14 +1,262 @@
 #!/usr/bin/env python3
 """A module for encrypting passwords.
 """
+import os
+import time
+import asyncio
+import threading
 import bcrypt
+from itertools import islice
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    CancelledError,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+
+DEFAULT_COST = 12
+_executor_lock = threading.Lock()
+_executor = None
+_cost_lock = threading.Lock()
+_cost = None
+
+
+def available_cores() -> int:
+    """Returns the number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the worker pool shared by the batch APIs."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=available_cores(),
+                thread_name_prefix="bcrypt",
+            )
+        return _executor
+
+
+def hash_cost(hashed_password: bytes) -> int:
+    """Returns the cost factor a bcrypt hash was made with."""
+    return int(hashed_password.split(b"$")[2])
+
+
+def time_cost(cost: int, rounds: int = 3) -> float:
+    """Returns the best time in ms of hashing a password at a cost."""
+    salt = bcrypt.gensalt(cost)
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration-password", salt)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def calibrate_cost(
+    target_ms: float = None,
+    min_cost: int = None,
+    max_cost: int = None,
+) -> int:
+    """Benchmarks the host and uses the highest cost within target_ms."""
+    global _cost
+    cost = _search_cost(target_ms, min_cost, max_cost)
+    with _cost_lock:
+        _cost = cost
+    return cost
+
+
+def set_cost(cost: Optional[int]) -> Optional[int]:
+    """Pins the cost of new hashes, None to resolve it again.
+
+    Returns the cost that was set before.
+    """
+    global _cost
+    with _cost_lock:
+        previous, _cost = _cost, cost
+    return previous
+
+
+def _search_cost(
+    target_ms: float = None,
+    min_cost: int = None,
+    max_cost: int = None,
+) -> int:
+    """Returns the highest cost the host hashes within target_ms.
+
+    Each cost step doubles the work, so the search stops as soon as the
+    next step would overshoot the target; the cost never drops below
+    min_cost however slow the host is.
+    """
+    if target_ms is None:
+        target_ms = float(os.getenv("PERSONAL_DATA_BCRYPT_TARGET_MS", "50"))
+    if min_cost is None:
+        min_cost = int(os.getenv("PERSONAL_DATA_BCRYPT_MIN_COST", "10"))
+    if max_cost is None:
+        max_cost = int(os.getenv("PERSONAL_DATA_BCRYPT_MAX_COST", "16"))
+    cost = min_cost
+    elapsed = time_cost(cost)
+    while cost < max_cost and elapsed * 2 <= target_ms:
+        elapsed = time_cost(cost + 1)
+        if elapsed > target_ms:
+            break
+        cost += 1
+    return cost
+
+
+def get_cost() -> int:
+    """Returns the cost factor new hashes are made with.
+
+    The first callers wait on the lock, so a calibration runs only once
+    and does not compete with other calibrations for the CPU.
+    """
+    global _cost
+    if _cost is not None:
+        return _cost
+    with _cost_lock:
+        if _cost is None:
+            if os.getenv("PERSONAL_DATA_BCRYPT_CALIBRATE", "0") == "1":
+                _cost = _search_cost()
+            else:
+                _cost = int(
+                    os.getenv("PERSONAL_DATA_BCRYPT_COST", DEFAULT_COST)
+                )
+        return _cost
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """Checks whether a hash uses a lower cost than the current one."""
+    return hash_cost(hashed_password) < get_cost()
 
 
 def hash_password(password: str) -> bytes:
     """Hashes a password using a random salt."""
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    salt = bcrypt.gensalt(get_cost())
+    return bcrypt.hashpw(password.encode("utf-8"), salt)
+
+
+def is_valid(
+    hashed_password: bytes,
+    password: str,
+    on_rehash: Optional[Callable[[bytes], None]] = None,
+) -> bool:
+    """Checks is a hashed password was formed from the given password.
+
+    When the password is valid but its hash uses an outdated cost,
+    on_rehash is called with a fresh hash for the caller to store.
+    """
+    valid = bcrypt.checkpw(password.encode("utf-8"), hashed_password)
+    if valid and on_rehash is not None and needs_rehash(hashed_password):
+        on_rehash(hash_password(password))
+    return valid
+
+
+def _run_many(
+    func: Callable,
+    calls: Sequence[Tuple],
+    cancel: Optional[threading.Event] = None,
+) -> list:
+    """Runs func over argument tuples on the pool, in input order.
+
+    At most two calls per worker are queued at a time, and setting the
+    cancel event stops the batch with a CancelledError.
+    """
+    executor = get_executor()
+    window = available_cores() * 2
+    results = [None] * len(calls)
+    pending = {}
+    index = 0
+    try:
+        while index < len(calls) or pending:
+            if cancel is not None and cancel.is_set():
+                raise CancelledError()
+            while index < len(calls) and len(pending) < window:
+                pending[executor.submit(func, *calls[index])] = index
+                index += 1
+            done, _ = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+    return results
+
+
+def hash_password_many(
+    passwords: Iterable[str],
+    cancel: Optional[threading.Event] = None,
+) -> List[bytes]:
+    """Hashes many passwords in parallel, keeping their order."""
+    calls = [(password,) for password in passwords]
+    return _run_many(hash_password, calls, cancel)
+
+
+def is_valid_many(
+    pairs: Iterable[Tuple[bytes, str]],
+    cancel: Optional[threading.Event] = None,
+) -> List[bool]:
+    """Checks many (hashed_password, password) pairs in parallel."""
+    return _run_many(is_valid, [tuple(pair) for pair in pairs], cancel)
+
+
+async def hash_password_async(password: str) -> bytes:
+    """Hashes a password on the worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), hash_password, password)
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    """Checks a password on the worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), is_valid, hashed_password, password
+    )
+
+
+async def _run_many_async(func: Callable, calls: Iterable[Tuple]) -> list:
+    """Awaits func over argument tuples on the pool, in input order.
+
+    Like _run_many, at most two calls per worker are in flight, and the
+    input is only consumed as they finish.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    window = available_cores() * 2
+    calls = iter(calls)
+    results = []
+    pending = {}
+    try:
+        while True:
+            for args in islice(calls, window - len(pending)):
+                future = loop.run_in_executor(executor, func, *args)
+                pending[future] = len(results)
+                results.append(None)
+            if not pending:
+                return results
+            done, _ = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                results[pending.pop(future)] = future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def hash_password_many_async(passwords: Iterable[str]) -> List[bytes]:
+    """Hashes many passwords on the worker pool, keeping their order."""
+    return await _run_many_async(
+        hash_password, ((password,) for password in passwords)
+    )
 
 
-def is_valid(hashed_password: bytes, password: str) -> bool:
-    """Checks is a hashed password was formed from the given password."""
-    return bcrypt.checkpw(password.encode("utf-8"), hashed_password)
+async def is_valid_many_async(
+    pairs: Iterable[Tuple[bytes, str]],
+) -> List[bool]:
+    """Checks many (hashed_password, password) pairs on the worker pool."""
+    return await _run_many_async(is_valid, (tuple(pair) for pair in pairs))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""A module for finding `field=value` pairs with an Aho-Corasick automaton.
+"""
+from collections import deque
+from typing import Iterator, List, Sequence, Tuple
+
+
+class FieldScanner:
+    """Finds the `field=` keys of many fields in one pass over a text.
+
+    Spans are reported exactly where the `field=[^separator]*` alternation
+    of filter_datum would match: leftmost first, never overlapping, with
+    each value running up to the next separator character. Field names
+    are matched literally and must not contain `=`.
+    """
+
+    def __init__(self, fields: Sequence[str], separator: str):
+        self.stops = frozenset(separator)
+        self.delta: List[dict] = [{}]
+        self.match: List[int] = [0]
+        for field in fields:
+            if field and "=" not in field:
+                self._insert(field + "=")
+        self._link()
+
+    def _insert(self, key: str):
+        """Adds a key to the trie of the automaton."""
+        state = 0
+        for ch in key:
+            nxt = self.delta[state].get(ch)
+            if nxt is None:
+                nxt = len(self.delta)
+                self.delta.append({})
+                self.match.append(0)
+                self.delta[state][ch] = nxt
+            state = nxt
+        self.match[state] = len(key)
+
+    def _link(self):
+        """Turns the trie into a full transition table via failure links."""
+        fail = [0] * len(self.delta)
+        goto = [dict(edges) for edges in self.delta]
+        order = deque(goto[0].values())
+        while order:
+            state = order.popleft()
+            for ch, nxt in goto[state].items():
+                target = fail[state]
+                while target and ch not in goto[target]:
+                    target = fail[target]
+                fail[nxt] = goto[target].get(ch, 0) if state else 0
+                order.append(nxt)
+        for state in self._breadth_first(goto):
+            if state:
+                merged = dict(self.delta[fail[state]])
+                merged.update(goto[state])
+                self.delta[state] = merged
+                if not self.match[state]:
+                    self.match[state] = self.match[fail[state]]
+
+    @staticmethod
+    def _breadth_first(goto: List[dict]) -> Iterator[int]:
+        """Yields the trie states shallowest first."""
+        order = deque([0])
+        while order:
+            state = order.popleft()
+            yield state
+            order.extend(goto[state].values())
+
+    def value_end(self, text: str, start: int) -> int:
+        """Returns the index of the first separator at or after start."""
+        stops = self.stops
+        if len(stops) == 1:
+            end = text.find(next(iter(stops)), start)
+            return len(text) if end < 0 else end
+        end, length = start, len(text)
+        while end < length and text[end] not in stops:
+            end += 1
+        return end
+
+    def scan(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Yields (key_start, value_start, value_end) for each pair."""
+        delta, match = self.delta, self.match
+        state, resume = 0, 0
+        for i, ch in enumerate(text):
+            if i < resume:
+                continue
+            state = delta[state].get(ch, 0)
+            length = match[state]
+            if length:
+                resume = self.value_end(text, i + 1)
+                yield i + 1 - length, i + 1, resume
+                state = 0
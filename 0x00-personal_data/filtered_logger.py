@@ -3,16 +3,121 @@
 """
 import os
 import re
+import copy
+import json
+import queue
+import atexit
 import logging
-import mysql.connector
-from typing import List
+import threading
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from field_scanner import FieldScanner
+from log_filters import SamplingFilter
+from db_pool import (
+    ConnectionPool,
+    MySQLBackend,
+    PooledConnection,
+    SQLiteBackend,
+)
+from user_export import export_rows
+from typing import Iterable, Iterator, List, Mapping, Optional, Sequence
 
 
 patterns = {
-    "extract": lambda x, y: r"(?P<field>{})=[^{}]*".format("|".join(x), y),
+    "extract": lambda x, y: r"(?P<field>{})=[^{}]*".format(
+        "|".join(map(re.escape, x)), y),
     "replace": lambda x: r"\g<field>={}".format(x),
 }
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
+USER_COLUMNS = (
+    "name",
+    "email",
+    "phone",
+    "ssn",
+    "password",
+    "ip",
+    "last_login",
+    "user_agent",
+)
+ENGINE_CACHE_SIZE = 128
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+OUTPUT_FORMATS = ("text", "json")
+_listener_lock = threading.Lock()
+_listener = None
+_pool_lock = threading.Lock()
+_pool = None
+
+
+class RedactionEngine:
+    """Redacts `field=value` pairs with a pattern compiled once.
+
+    Field names are escaped, so they match literally as in FieldScanner.
+    """
+
+    def __init__(self, fields: Sequence[str], separator: str, redaction: str):
+        extract, replace = (patterns["extract"], patterns["replace"])
+        self.fields = tuple(fields)
+        self.separator = separator
+        self.redaction = redaction
+        self.regex = re.compile(extract(self.fields, separator))
+        self.template = replace(redaction)
+
+    def redact(self, message: str) -> str:
+        """Redacts the values of the engine's fields in a message."""
+        return self.regex.sub(self.template, message)
+
+
+class AhoCorasickEngine(RedactionEngine):
+    """Redacts `field=value` pairs found by a FieldScanner automaton."""
+
+    def __init__(self, fields: Sequence[str], separator: str, redaction: str):
+        super(AhoCorasickEngine, self).__init__(fields, separator, redaction)
+        self.scanner = FieldScanner(self.fields, separator)
+        self.replacements = {
+            field: self.regex.sub(self.template, "{}=".format(field))
+            for field in self.fields
+        }
+
+    def redact(self, message: str) -> str:
+        """Redacts the values of the engine's fields in a message."""
+        parts, cursor = [], 0
+        for start, value_start, end in self.scanner.scan(message):
+            parts.append(message[cursor:start])
+            parts.append(self.replacements[message[start:value_start - 1]])
+            cursor = end
+        if not parts:
+            return message
+        parts.append(message[cursor:])
+        return "".join(parts)
+
+
+BACKENDS = {
+    "regex": RedactionEngine,
+    "aho_corasick": AhoCorasickEngine,
+}
+
+
+@lru_cache(maxsize=ENGINE_CACHE_SIZE)
+def _cached_engine(
+    fields: tuple,
+    separator: str,
+    redaction: str,
+    backend: str,
+) -> RedactionEngine:
+    """Builds the engine for a hashable (fields, separator, redaction)."""
+    return BACKENDS[backend](fields, separator, redaction)
+
+
+def get_engine(
+    fields: Sequence[str],
+    separator: str,
+    redaction: str,
+    backend: str = "regex",
+) -> RedactionEngine:
+    """Returns the cached redaction engine for the given settings."""
+    if backend not in BACKENDS:
+        raise ValueError("unknown redaction backend: {}".format(backend))
+    return _cached_engine(tuple(fields), separator, redaction, backend)
 
 
 def filter_datum(
@@ -22,56 +127,303 @@ def filter_datum(
     separator: str,
 ) -> str:
     """Filters a log line."""
-    extract, replace = (patterns["extract"], patterns["replace"])
-    return re.sub(extract(fields, separator), replace(redaction), message)
+    return get_engine(fields, separator, redaction).redact(message)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Queue handler applying an overflow policy to a bounded queue."""
+
+    def __init__(self, log_queue: queue.Queue, overflow: str = "block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("unknown overflow policy: {}".format(overflow))
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Copies a record, leaving what must be redacted unformatted.
+
+        The user_data dict, %-mapping args and the traceback text are kept
+        apart, so the formatter redacts them in the listener thread.
+        """
+        record = copy.copy(record)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info
+                )
+            record.exc_info = None
+        if not isinstance(record.args, Mapping):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """Puts a record on the queue, dropping one if it is full."""
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == "drop_newest":
+                    return
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                pass
+
+
+class BlockingQueueListener(QueueListener):
+    """Queue listener whose stop sentinel waits for room in the queue."""
+
+    def enqueue_sentinel(self):
+        """Blocks until the stop sentinel fits in the queue."""
+        self.queue.put(self._sentinel)
 
 
 def get_logger() -> logging.Logger:
     """Creates a new logger for user data."""
+    global _listener
     logger = logging.getLogger("user_data")
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(RedactingFormatter(PII_FIELDS))
     logger.setLevel(logging.INFO)
     logger.propagate = False
-    logger.addHandler(stream_handler)
+    with _listener_lock:
+        if _listener is not None:
+            return logger
+        size = int(os.getenv("PERSONAL_DATA_LOG_QUEUE_SIZE", "10000"))
+        overflow = os.getenv("PERSONAL_DATA_LOG_OVERFLOW", "block")
+        log_queue = queue.Queue(size)
+        output = os.getenv("PERSONAL_DATA_LOG_FORMAT", "text")
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(
+            RedactingFormatter(PII_FIELDS, output=output)
+        )
+        sampling = sampling_filter()
+        if sampling is not None:
+            logger.addFilter(sampling)
+        logger.addHandler(BoundedQueueHandler(log_queue, overflow))
+        _listener = BlockingQueueListener(log_queue, stream_handler)
+        _listener.start()
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
-    """Creates a connector to a database."""
+def sampling_filter() -> Optional[SamplingFilter]:
+    """Creates the sampling filter configured by the environment."""
+    sample_every = int(os.getenv("PERSONAL_DATA_LOG_SAMPLE_EVERY", "1"))
+    rate = float(os.getenv("PERSONAL_DATA_LOG_RATE", "0"))
+    if sample_every <= 1 and rate <= 0:
+        return None
+    burst = os.getenv("PERSONAL_DATA_LOG_BURST")
+    return SamplingFilter(
+        sample_every=sample_every,
+        rate=rate,
+        burst=None if burst is None else float(burst),
+        summary_interval=float(
+            os.getenv("PERSONAL_DATA_LOG_SUMMARY_INTERVAL", "60")
+        ),
+    )
+
+
+def flush_summaries(logger: logging.Logger):
+    """Emits the suppressed-records summaries a logger still holds."""
+    for log_filter in list(logger.filters):
+        if isinstance(log_filter, SamplingFilter):
+            log_filter.flush()
+
+
+def flush_logger():
+    """Waits until every queued user data record has been written."""
+    with _listener_lock:
+        listener = _listener
+    if listener is None:
+        return
+    flush_summaries(logging.getLogger("user_data"))
+    listener.queue.join()
+    for handler in listener.handlers:
+        handler.flush()
+
+
+def shutdown_logger():
+    """Drains the queue and stops the user data background listener."""
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+        if listener is None:
+            return
+        logger = logging.getLogger("user_data")
+        flush_summaries(logger)
+        for handler in list(logger.handlers):
+            if isinstance(handler, BoundedQueueHandler):
+                logger.removeHandler(handler)
+        for log_filter in list(logger.filters):
+            if isinstance(log_filter, SamplingFilter):
+                logger.removeFilter(log_filter)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
+        handler.close()
+
+
+atexit.register(shutdown_logger)
+
+
+def get_db() -> PooledConnection:
+    """Checks out a pooled connector to a database."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                db_backend(),
+                size=int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE", "5")),
+                timeout=float(
+                    os.getenv("PERSONAL_DATA_DB_POOL_TIMEOUT", "30")
+                ),
+                recycle=float(
+                    os.getenv("PERSONAL_DATA_DB_POOL_RECYCLE", "3600")
+                ),
+                pre_ping=os.getenv("PERSONAL_DATA_DB_PRE_PING", "1") == "1",
+            )
+    return _pool.acquire()
+
+
+def close_db():
+    """Closes the idle connections of the pool and drops the pool."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+atexit.register(close_db)
+
+
+def db_backend():
+    """Creates the connection backend selected by the environment."""
     db_host = os.getenv("PERSONAL_DATA_DB_HOST", "localhost")
+    db_port = int(os.getenv("PERSONAL_DATA_DB_PORT", "3306"))
     db_name = os.getenv("PERSONAL_DATA_DB_NAME", "")
     db_user = os.getenv("PERSONAL_DATA_DB_USERNAME", "root")
     db_pwd = os.getenv("PERSONAL_DATA_DB_PASSWORD", "")
-    connection = mysql.connector.connect(
+    backend = os.getenv("PERSONAL_DATA_DB_BACKEND", "mysql")
+    if backend == "sqlite":
+        return SQLiteBackend(db_name)
+    if backend != "mysql":
+        raise ValueError("unknown database backend: {}".format(backend))
+    return MySQLBackend(
         host=db_host,
-        port=3306,
+        port=db_port,
         user=db_user,
         password=db_pwd,
         database=db_name,
     )
-    return connection
+
+
+def build_query(
+    columns: Sequence[str],
+    where: str = "",
+    resume_key: str = "",
+) -> str:
+    """Builds the users query, optionally resuming after a key value."""
+    clauses = ["({})".format(where)] if where else []
+    if resume_key:
+        if resume_key not in columns:
+            raise ValueError("unknown resume key: {}".format(resume_key))
+        clauses.append("{} > %s".format(resume_key))
+    query = "SELECT {} FROM users".format(",".join(columns))
+    if clauses:
+        query += " WHERE {}".format(" AND ".join(clauses))
+    if resume_key:
+        query += " ORDER BY {}".format(resume_key)
+    return "{};".format(query)
+
+
+def stream_rows(cursor, batch_size: int) -> Iterator[tuple]:
+    """Yields the rows of an executed cursor one batch at a time."""
+    rows = cursor.fetchmany(batch_size)
+    while rows:
+        yield from rows
+        rows = cursor.fetchmany(batch_size)
+
+
+def row_dicts(
+    columns: Sequence[str],
+    rows: Iterable[tuple],
+) -> Iterator[dict]:
+    """Yields each row as a {column: value} dict."""
+    for row in rows:
+        yield dict(zip(columns, row))
+
+
+def build_records(items: Iterable[dict]) -> Iterator[logging.LogRecord]:
+    """Yields a structured user_data LogRecord for each dict."""
+    for data in items:
+        args = ("user_data", logging.INFO, None, None, "", None, None)
+        log_record = logging.LogRecord(*args)
+        log_record.user_data = data
+        yield log_record
+
+
+def structured_data(record: logging.LogRecord) -> Optional[Mapping]:
+    """Returns the user_data dict a record was logged with, if any."""
+    data = getattr(record, "user_data", None)
+    if isinstance(data, Mapping):
+        return data
+    return None
 
 
 def main():
     """Logs the information about user records in a table."""
-    fields = "name,email,phone,ssn,password,ip,last_login,user_agent"
-    columns = fields.split(",")
-    query = "SELECT {} FROM users;".format(fields)
-    info_logger = get_logger()
+    columns = USER_COLUMNS
+    batch_size = int(os.getenv("PERSONAL_DATA_BATCH_SIZE", "1000"))
+    where = os.getenv("PERSONAL_DATA_WHERE", "")
+    resume_key = os.getenv("PERSONAL_DATA_RESUME_KEY", "")
+    resume_after = os.getenv("PERSONAL_DATA_RESUME_AFTER")
+    if resume_after is None:
+        resume_key = ""
+    query = build_query(columns, where, resume_key)
+    params = (resume_after,) if resume_key else ()
+    export_path = os.getenv("PERSONAL_DATA_EXPORT_PATH", "")
     connection = get_db()
-    with connection.cursor() as cursor:
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        for row in rows:
-            record = map(
-                lambda x: "{}={}".format(x[0], x[1]),
-                zip(columns, row),
-            )
-            msg = "{};".format("; ".join(list(record)))
-            args = ("user_data", logging.INFO, None, None, msg, None, None)
-            log_record = logging.LogRecord(*args)
-            info_logger.handle(log_record)
+    try:
+        with connection.cursor(buffered=False) as cursor:
+            cursor.execute(query, params)
+            rows = stream_rows(cursor, batch_size)
+            if export_path:
+                export_users(export_path, columns, rows, batch_size)
+            else:
+                info_logger = get_logger()
+                for log_record in build_records(row_dicts(columns, rows)):
+                    info_logger.handle(log_record)
+    finally:
+        connection.close()
+        shutdown_logger()
+
+
+def export_users(
+    path: str,
+    columns: Sequence[str],
+    rows: Iterable[tuple],
+    batch_size: int,
+) -> int:
+    """Writes redacted user rows to a compressed NDJSON or CSV file."""
+    level = os.getenv("PERSONAL_DATA_EXPORT_LEVEL")
+    return export_rows(
+        path,
+        columns,
+        rows,
+        PII_FIELDS,
+        RedactingFormatter.REDACTION,
+        fmt=os.getenv("PERSONAL_DATA_EXPORT_FORMAT") or None,
+        compression=os.getenv("PERSONAL_DATA_EXPORT_COMPRESSION") or None,
+        level=None if level is None else int(level),
+        batch_size=batch_size,
+    )
 
 
 class RedactingFormatter(logging.Formatter):
@@ -82,15 +434,113 @@ class RedactingFormatter(logging.Formatter):
     FORMAT_FIELDS = ("name", "levelname", "asctime", "message")
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(
+        self,
+        fields: List[str],
+        backend: str = "regex",
+        output: str = "text",
+    ):
+        if output not in OUTPUT_FORMATS:
+            raise ValueError("unknown output format: {}".format(output))
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.field_set = frozenset(fields)
+        self.output = output
+        self.engine = get_engine(
+            fields, self.SEPARATOR, self.REDACTION, backend
+        )
 
     def format(self, record: logging.LogRecord) -> str:
         """formats a LogRecord."""
+        data = structured_data(record)
+        if data is not None or isinstance(record.args, Mapping):
+            return self.format_structured(record, data)
+        if self.output == "json":
+            msg = self.engine.redact(record.getMessage())
+            return self.to_json(record, msg)
         msg = super(RedactingFormatter, self).format(record)
-        txt = filter_datum(self.fields, self.REDACTION, msg, self.SEPARATOR)
-        return txt
+        return self.engine.redact(msg)
+
+    def redact_data(self, data: Mapping) -> dict:
+        """Redacts the values of a dict as in its `key=value` text.
+
+        PII keys are masked by lookup. The other pairs still go through
+        the engine, so a `username` key or a value holding `name=...` is
+        masked just as the regex masks it in a formatted line.
+        """
+        redacted = {}
+        for key, value in data.items():
+            if key in self.field_set:
+                redacted[key] = self.REDACTION
+                continue
+            pair = "{}={}".format(key, value)
+            masked = self.engine.redact(pair)
+            if masked == pair:
+                redacted[key] = value
+            elif masked.startswith("{}=".format(key)):
+                redacted[key] = masked[len(key) + 1:]
+            else:
+                redacted[key] = masked
+        return redacted
+
+    def format_structured(
+        self,
+        record: logging.LogRecord,
+        data: Optional[Mapping],
+    ) -> str:
+        """formats a LogRecord carrying dicts, redacted by key lookup.
+
+        %-mapping args are redacted before the message is rendered, and
+        the user_data fields follow the message as `key=value;` pairs.
+        """
+        msg = record.msg if isinstance(record.msg, str) else str(record.msg)
+        if isinstance(record.args, Mapping) and record.args:
+            msg = msg % self.redact_data(record.args)
+        msg = self.engine.redact(msg)
+        data = None if data is None else self.redact_data(data)
+        if self.output == "json":
+            return self.to_json(record, msg, data)
+        fields = "" if not data else "{};".format("; ".join(
+            "{}={}".format(key, value) for key, value in data.items()
+        ))
+        record.message = " ".join(part for part in (msg, fields) if part)
+        record.asctime = self.formatTime(record, self.datefmt)
+        return self.formatMessage(record) + "".join(
+            "\n" + text for text in self.error_texts(record)
+        )
+
+    def error_texts(self, record: logging.LogRecord) -> List[str]:
+        """Returns the redacted traceback and stack texts of a record."""
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        texts = []
+        if record.exc_text:
+            texts.append(self.engine.redact(record.exc_text))
+        if record.stack_info:
+            texts.append(self.engine.redact(
+                self.formatStack(record.stack_info)
+            ))
+        return texts
+
+    def to_json(
+        self,
+        record: logging.LogRecord,
+        message: str,
+        data: Optional[dict] = None,
+    ) -> str:
+        """Serializes a record and its redacted message as a JSON line."""
+        entry = {
+            "name": record.name,
+            "levelname": record.levelname,
+            "asctime": self.formatTime(record, self.datefmt),
+            "message": message,
+        }
+        if data is not None:
+            entry["user_data"] = data
+        texts = self.error_texts(record)
+        if texts:
+            entry["exc_info"] = "\n".join(texts)
+        return json.dumps(entry, default=str)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""A module for thinning out high-volume logs before they are formatted.
+"""
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Callable, Dict, Tuple
+
+
+MAX_KEYS = 10000
+
+
+class SamplingFilter(logging.Filter):
+    """Samples and rate limits records before any formatting happens.
+
+    Records sharing a message key (the unformatted msg, or a sample_key
+    given through extra) are kept 1 in sample_every. Each logger then
+    spends one token per record from a bucket refilled at rate per
+    second, up to burst. Suppressed records are counted and reported in
+    a summary record at most once per summary_interval, or by flush.
+    """
+
+    def __init__(
+        self,
+        sample_every: int = 1,
+        rate: float = 0.0,
+        burst: float = None,
+        summary_interval: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super(SamplingFilter, self).__init__()
+        self.sample_every = max(1, sample_every)
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.summary_interval = summary_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._seen: Dict[Tuple[str, str], int] = {}
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._suppressed = Counter()
+        self._last_summary = clock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Decides whether a record goes on to the handlers."""
+        if getattr(record, "sampling_summary", False):
+            return True
+        key = getattr(record, "sample_key", record.msg)
+        with self._lock:
+            allowed = self._sample((record.name, str(key)))
+            if allowed and self.rate > 0:
+                allowed = self._take(record.name)
+            if not allowed:
+                if not self._suppressed:
+                    self._last_summary = self.clock()
+                self._suppressed[record.name] += 1
+            summary = self._pop_summary()
+        for name, count in summary.items():
+            self._emit_summary(name, count)
+        return allowed
+
+    def _sample(self, key: Tuple[str, str]) -> bool:
+        """Keeps the first of every sample_every records with a key."""
+        if self.sample_every == 1:
+            return True
+        if len(self._seen) >= MAX_KEYS and key not in self._seen:
+            self._seen.clear()
+        count = self._seen.get(key, 0)
+        self._seen[key] = count + 1
+        return count % self.sample_every == 0
+
+    def _take(self, name: str) -> bool:
+        """Spends a token from the bucket of a logger, if one is left."""
+        now = self.clock()
+        tokens, last = self._buckets.get(name, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[name] = (tokens, now)
+            return False
+        self._buckets[name] = (tokens - 1, now)
+        return True
+
+    def flush(self):
+        """Emits the pending summary now, even before it is due."""
+        with self._lock:
+            summary = self._pop_summary(force=True)
+        for name, count in summary.items():
+            self._emit_summary(name, count)
+
+    def _pop_summary(self, force: bool = False) -> Dict[str, int]:
+        """Returns and resets the suppressed counts once they are due."""
+        now = self.clock()
+        if not self._suppressed:
+            return {}
+        if not force and now - self._last_summary < self.summary_interval:
+            return {}
+        summary = dict(self._suppressed)
+        self._suppressed.clear()
+        self._last_summary = now
+        return summary
+
+    def _emit_summary(self, name: str, count: int):
+        """Logs how many records of a logger were suppressed."""
+        record = logging.LogRecord(
+            name,
+            logging.WARNING,
+            None,
+            None,
+            "suppressed %d records",
+            (count,),
+            None,
+        )
+        record.sampling_summary = True
+        logging.getLogger(name).handle(record)
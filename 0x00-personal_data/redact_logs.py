@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""A command line tool for redacting existing log files.
+"""
+import os
+import sys
+import gzip
+import mmap
+import shutil
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Sequence, Tuple
+from filtered_logger import (
+    BACKENDS,
+    PII_FIELDS,
+    RedactingFormatter,
+    get_engine,
+)
+
+
+CHUNK_SIZE = 8 * 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def redact_bytes(
+    fields: Sequence[str],
+    separator: str,
+    redaction: str,
+    backend: str,
+    data: bytes,
+) -> bytes:
+    """Redacts a block of whole log lines."""
+    # Values never run past the end of their line, so a block of lines is
+    # redacted exactly as if each line went through filter_datum alone.
+    engine = get_engine(fields, separator + "\n", redaction, backend)
+    text = data.decode("utf-8", "surrogateescape")
+    return engine.redact(text).encode("utf-8", "surrogateescape")
+
+
+def redact_range(
+    path: str,
+    start: int,
+    end: int,
+    fields: Sequence[str],
+    separator: str,
+    redaction: str,
+    backend: str,
+) -> bytes:
+    """Redacts the lines between two offsets of a plain log file."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            block = data[start:end]
+    return redact_bytes(fields, separator, redaction, backend, block)
+
+
+def chunk_bounds(data: mmap.mmap, size: int) -> Iterator[Tuple[int, int]]:
+    """Yields (start, end) offsets of chunks ending on line boundaries."""
+    start, length = 0, len(data)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            newline = data.find(b"\n", end - 1)
+            end = length if newline < 0 else newline + 1
+        yield start, end
+        start = end
+
+
+def gzip_chunks(f: BinaryIO, size: int) -> Iterator[bytes]:
+    """Yields chunks of whole lines from a decompressed stream."""
+    tail = b""
+    block = f.read(size)
+    while block:
+        block = tail + block
+        newline = block.rfind(b"\n")
+        if newline < 0:
+            tail = block
+        else:
+            tail = block[newline + 1:]
+            yield block[:newline + 1]
+        block = f.read(size)
+    if tail:
+        yield tail
+
+
+def is_gzip(path: str) -> bool:
+    """Checks whether a file starts with the gzip magic number."""
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def submit_chunks(
+    executor: Executor,
+    path: str,
+    fields: Sequence[str],
+    separator: str,
+    redaction: str,
+    backend: str,
+    chunk_size: int,
+    window: int,
+) -> Iterator[bytes]:
+    """Redacts the chunks of a file in parallel, yielding them in order."""
+    pending = deque()
+    args = (fields, separator, redaction, backend)
+    if is_gzip(path):
+        with gzip.open(path, "rb") as f:
+            for block in gzip_chunks(f, chunk_size):
+                pending.append(executor.submit(redact_bytes, *args, block))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+    elif os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                bounds = list(chunk_bounds(data, chunk_size))
+        for start, end in bounds:
+            pending.append(
+                executor.submit(redact_range, path, start, end, *args)
+            )
+            if len(pending) >= window:
+                yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def redact_file(
+    src: str,
+    dst: str,
+    fields: Sequence[str] = PII_FIELDS,
+    separator: str = RedactingFormatter.SEPARATOR,
+    redaction: str = RedactingFormatter.REDACTION,
+    workers: int = None,
+    chunk_size: int = CHUNK_SIZE,
+    compress: bool = None,
+    backend: str = "regex",
+):
+    """Redacts a log file into dst, which may be src itself."""
+    workers = workers or os.cpu_count() or 1
+    if compress is None:
+        compress = dst.endswith(".gz")
+    directory = os.path.dirname(os.path.abspath(dst))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".redact-")
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            out = gzip.GzipFile(fileobj=raw, mode="wb") if compress else raw
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunks = submit_chunks(
+                    executor,
+                    src,
+                    tuple(fields),
+                    separator,
+                    redaction,
+                    backend,
+                    chunk_size,
+                    workers * 2,
+                )
+                for chunk in chunks:
+                    out.write(chunk)
+            if compress:
+                out.close()
+        if os.path.exists(dst):
+            shutil.copymode(dst, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """Parses the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("input", help="log file to redact (plain or gzip)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("-o", "--output", help="file to write")
+    target.add_argument(
+        "-i", "--in-place", action="store_true", help="replace the input"
+    )
+    parser.add_argument(
+        "-f",
+        "--fields",
+        default=",".join(PII_FIELDS),
+        help="comma separated fields to redact",
+    )
+    parser.add_argument("-s", "--separator", default=";")
+    parser.add_argument("-r", "--redaction", default="***")
+    parser.add_argument(
+        "-b", "--backend", choices=sorted(BACKENDS), default="regex"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-c", "--chunk-size", type=int, default=CHUNK_SIZE)
+    compression = parser.add_mutually_exclusive_group()
+    compression.add_argument(
+        "-z", "--gzip", dest="compress", action="store_true", default=None
+    )
+    compression.add_argument(
+        "--no-gzip", dest="compress", action="store_false"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    """Redacts a log file from the command line."""
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    compress = args.compress
+    if args.in_place and compress is None:
+        compress = is_gzip(args.input)
+    redact_file(
+        args.input,
+        args.input if args.in_place else args.output,
+        [field for field in args.fields.split(",") if field],
+        args.separator,
+        args.redaction,
+        args.workers,
+        args.chunk_size,
+        compress,
+        args.backend,
+    )
+
+
+if __name__ == "__main__":
+    main()
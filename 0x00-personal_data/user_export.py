@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""A module for exporting redacted user rows to compressed files.
+"""
+import io
+import csv
+import gzip
+import json
+from typing import BinaryIO, Iterable, Sequence
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+FORMATS = ("ndjson", "csv")
+COMPRESSIONS = ("none", "gzip", "zstd")
+BUFFER_SIZE = 1024 * 1024
+
+
+def guess_format(path: str) -> str:
+    """Guesses the export format from a file name."""
+    name = path.lower()
+    for suffix in (".gz", ".zst"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return "csv" if name.endswith(".csv") else "ndjson"
+
+
+def guess_compression(path: str) -> str:
+    """Guesses the compression codec from a file name."""
+    name = path.lower()
+    if name.endswith(".gz"):
+        return "gzip"
+    if name.endswith(".zst"):
+        return "zstd"
+    return "none"
+
+
+def open_output(path: str, compression: str, level: int = None) -> BinaryIO:
+    """Opens a binary file, compressing what is written to it."""
+    if compression == "gzip":
+        return gzip.open(path, "wb", 6 if level is None else level)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        level = 3 if level is None else level
+        compressor = zstandard.ZstdCompressor(level=level)
+        return compressor.stream_writer(open(path, "wb"), closefd=True)
+    if compression == "none":
+        return open(path, "wb", buffering=BUFFER_SIZE)
+    raise ValueError("unknown compression: {}".format(compression))
+
+
+def redact_rows(
+    columns: Sequence[str],
+    rows: Iterable[tuple],
+    fields: Sequence[str],
+    redaction: str,
+) -> Iterable[list]:
+    """Yields each row with the values of PII columns replaced."""
+    masked = [i for i, column in enumerate(columns) if column in fields]
+    for row in rows:
+        row = list(row)
+        for i in masked:
+            row[i] = redaction
+        yield row
+
+
+def write_ndjson(
+    out: BinaryIO,
+    columns: Sequence[str],
+    rows: Iterable[list],
+    batch_size: int,
+) -> int:
+    """Writes rows as JSON lines, one write per batch."""
+    encode = json.JSONEncoder(default=str).encode
+    lines, count = [], 0
+    for row in rows:
+        lines.append(encode(dict(zip(columns, row))))
+        if len(lines) >= batch_size:
+            out.write(("\n".join(lines) + "\n").encode("utf-8"))
+            count += len(lines)
+            lines.clear()
+    if lines:
+        out.write(("\n".join(lines) + "\n").encode("utf-8"))
+        count += len(lines)
+    return count
+
+
+def write_csv(
+    out: BinaryIO,
+    columns: Sequence[str],
+    rows: Iterable[list],
+    batch_size: int,
+) -> int:
+    """Writes rows as CSV with a header, one write per batch."""
+    text = io.TextIOWrapper(
+        out, encoding="utf-8", newline="", write_through=False
+    )
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    batch, count = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            writer.writerows(batch)
+            count += len(batch)
+            batch.clear()
+    writer.writerows(batch)
+    text.flush()
+    text.detach()
+    return count + len(batch)
+
+
+def export_rows(
+    path: str,
+    columns: Sequence[str],
+    rows: Iterable[tuple],
+    fields: Sequence[str],
+    redaction: str = "***",
+    fmt: str = None,
+    compression: str = None,
+    level: int = None,
+    batch_size: int = 1000,
+) -> int:
+    """Writes redacted rows to a file and returns how many were written."""
+    fmt = fmt or guess_format(path)
+    if fmt not in FORMATS:
+        raise ValueError("unknown export format: {}".format(fmt))
+    compression = compression or guess_compression(path)
+    redacted = redact_rows(columns, rows, frozenset(fields), redaction)
+    write = write_csv if fmt == "csv" else write_ndjson
+    with open_output(path, compression, level) as out:
+        return write(out, columns, redacted, batch_size)
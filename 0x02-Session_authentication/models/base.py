@@ -1,28 +1,88 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
-import json
+from datetime import datetime, timedelta
+from typing import Callable, TypeVar, List, Iterable, Sequence, Tuple
+from os import getenv
+from threading import Lock
+from types import MemberDescriptorType
+from models.engine.file_storage import FileStorage
+from models.engine.query import Query
+from models.engine.serializer import (EPOCH, MICROSECOND, TIMESTAMP_FORMAT,
+                                      compile_loader, compile_serializer)
+from models.engine.storage import Storage
 import uuid
 
 
-TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+SLOT_ATTRIBUTES = {"_created_at": "created_at", "_updated_at": "updated_at"}
+TIMESTAMP_SLOTS = {name: slot for slot, name in SLOT_ATTRIBUTES.items()}
+MISSING = object()
+ATTRIBUTES = {}
+SERIALIZERS = {}
+LOADERS = {}
+STORAGE = None
+STORAGE_LOCK = Lock()
+
+
+def _now_micros() -> int:
+    """ Current time as microseconds since the epoch
+    """
+    return (datetime.utcnow() - EPOCH) // MICROSECOND
+
+
+class IndexedSlot():
+    """ Slot of an indexed attribute, telling the storage of assignments
+
+    Objects changed in memory without save() are then still found by
+    their current value.
+    """
+
+    def __init__(self, slot):
+        """ Wrap the member descriptor of a slot
+        """
+        self.slot = slot
+        self.name = slot.__name__
+
+    def __get__(self, obj, owner=None):
+        """ Value of the slot
+        """
+        if obj is None:
+            return self
+        return self.slot.__get__(obj, owner)
+
+    def __set__(self, obj, value):
+        """ Set the slot, then let the storage reindex the object
+        """
+        self.slot.__set__(obj, value)
+        if STORAGE is not None:
+            STORAGE.changed(obj, self.name)
+
+    def __delete__(self, obj):
+        """ Clear the slot
+        """
+        self.slot.__delete__(obj)
 
 
 class Base():
     """ Base class
     """
 
+    __slots__ = ("id", "_created_at", "_updated_at")
+    indexed_attributes: Tuple[str, ...] = ()
+    interned_attributes: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs: dict):
+        """ Wrap the slots of the indexed attributes in IndexedSlot
+        """
+        super().__init_subclass__(**kwargs)
+        for name in cls.indexed_attributes:
+            slot = getattr(cls, name, None)
+            if isinstance(slot, MemberDescriptorType):
+                setattr(cls, name, IndexedSlot(slot))
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
             self.created_at = datetime.strptime(kwargs.get('created_at'),
@@ -34,6 +94,9 @@ class Base():
                                                 TIMESTAMP_FORMAT)
         else:
             self.updated_at = datetime.utcnow()
+        # equal ints are distinct objects; share one to save its memory
+        if self._updated_at == self._created_at:
+            self._updated_at = self._created_at
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -44,69 +107,165 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @property
+    def created_at(self) -> datetime:
+        """ Creation time, stored as microseconds since the epoch
+        """
+        return EPOCH + timedelta(microseconds=self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation time
+        """
+        self._created_at = (value - EPOCH) // MICROSECOND
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Last update time, stored as microseconds since the epoch
+        """
+        return EPOCH + timedelta(microseconds=self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update time
+        """
+        self._updated_at = (value - EPOCH) // MICROSECOND
+
+    @staticmethod
+    def parse_timestamp(value: str) -> int:
+        """ Microseconds since the epoch of a serialized timestamp
+
+        None gives the current time, as for a new object.
+        """
+        if value is None:
+            return _now_micros()
+        return (datetime.fromisoformat(value) - EPOCH) // MICROSECOND
+
+    @classmethod
+    def attributes(cls) -> Tuple[str, ...]:
+        """ Names of the serialized attributes, in declaration order
+        """
+        names = ATTRIBUTES.get(cls)
+        if names is None:
+            names = tuple(
+                SLOT_ATTRIBUTES.get(slot, slot)
+                for klass in reversed(cls.__mro__)
+                for slot in klass.__dict__.get("__slots__", ())
+            )
+            ATTRIBUTES[cls] = names
+        return names
+
+    @classmethod
+    def serializer(cls, for_serialization: bool = False) -> Callable:
+        """ to_json function compiled once for the class attributes
+        """
+        key = (cls, for_serialization)
+        if key not in SERIALIZERS:
+            SERIALIZERS[key] = compile_serializer(
+                cls.attributes(), TIMESTAMP_SLOTS, for_serialization,
+                TIMESTAMP_FORMAT)
+        return SERIALIZERS[key]
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
+        try:
+            return self.__class__.serializer(for_serialization)(self)
+        except AttributeError:
+            pass
         result = {}
-        for key, value in self.__dict__.items():
+        for key in self.__class__.attributes():
             if not for_serialization and key[0] == '_':
                 continue
+            value = getattr(self, key, MISSING)
+            if value is MISSING:
+                continue
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
             else:
                 result[key] = value
         return result
 
+    def to_row(self) -> tuple:
+        """ Values of the attributes, timestamps as microseconds
+        """
+        return tuple(getattr(self, TIMESTAMP_SLOTS.get(name, name), None)
+                     for name in self.__class__.attributes())
+
+    @classmethod
+    def from_row(cls, names: Sequence[str], row: tuple) -> TypeVar('Base'):
+        """ Object from the values of the named attributes, without parsing
+        """
+        key = (cls, tuple(names))
+        load = LOADERS.get(key)
+        if load is None:
+            known = set(cls.attributes())
+            slots = [TIMESTAMP_SLOTS.get(name, name) if name in known
+                     else None for name in names]
+            missing = {
+                TIMESTAMP_SLOTS.get(name, name):
+                    _now_micros if name in TIMESTAMP_SLOTS else None
+                for name in cls.attributes() if name not in names
+            }
+            load = LOADERS[key] = compile_loader(cls, slots, missing)
+        return load(row)
+
+    @staticmethod
+    def _storage() -> Storage:
+        """ Backend selected by MODEL_STORAGE, created on first use
+        """
+        global STORAGE
+        if STORAGE is None:
+            with STORAGE_LOCK:
+                if STORAGE is None:
+                    backend = getenv("MODEL_STORAGE", "json")
+                    if backend == "json":
+                        STORAGE = FileStorage()
+                    elif backend == "sqlite":
+                        from models.engine.sqlite_storage import \
+                            SQLiteStorage
+
+                        STORAGE = SQLiteStorage(
+                            getenv("MODEL_SQLITE_PATH", ".db.sqlite3"))
+                    else:
+                        raise ValueError(
+                            "unknown MODEL_STORAGE {!r}".format(backend))
+        return STORAGE
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        Base._storage().load(cls)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        Base._storage().save_to_file(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @staticmethod
+    def flush():
+        """ Commit every change the storage still buffers
+        """
+        if STORAGE is not None:
+            STORAGE.flush()
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        Base._storage().save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        Base._storage().remove(self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return Base._storage().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,20 +277,16 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return Base._storage().get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return Base._storage().search(cls, attributes)
+
+    @classmethod
+    def query(cls) -> Query:
+        """ Query over all objects, refined with where, order_by and limit
+        """
+        return Query(cls, Base._storage())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+""" Coherence module
+"""
+from contextlib import contextmanager
+from os import stat
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+import fcntl
+import threading
+
+
+def signature(file_path: str) -> Optional[Tuple[int, int, int]]:
+    """ Inode, modification time and size of a file, None if missing
+    """
+    try:
+        st = stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class Coherence():
+    """ Advisory lock and change tracking for the files of one model class
+
+    Writers hold the lock file exclusively and readers share it, across
+    every process using the same files. `snapshot` and `offsets` record
+    what this process last saw: the signatures of the snapshot files and,
+    per journal segment inode, how many bytes were already applied.
+    """
+
+    def __init__(self, lock_path: str):
+        """ Initialize a coherence tracker using the file at lock_path
+        """
+        self.lock_path = lock_path
+        self.snapshot = None
+        self.offsets: Dict[int, int] = {}
+        self._lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        """ Hold the lock file shared, or keep the mode already held
+        """
+        with self._hold(fcntl.LOCK_SH):
+            yield
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """ Hold the lock file exclusively, or keep the mode already held
+        """
+        with self._hold(fcntl.LOCK_EX):
+            yield
+
+    def changed(self, snapshot_paths: Sequence[str],
+                segment_paths: Sequence[str]) -> bool:
+        """ Whether the files moved on since the last record
+        """
+        if self.snapshot_changed(snapshot_paths):
+            return True
+        for file_path in segment_paths:
+            sig = signature(file_path)
+            if sig is not None and sig[2] != self.offsets.get(sig[0], 0):
+                return True
+        return False
+
+    def snapshot_changed(self, snapshot_paths: Sequence[str]) -> bool:
+        """ Whether a snapshot file was rewritten since the last record
+        """
+        return [signature(p) for p in snapshot_paths] != self.snapshot
+
+    def record(self, snapshot_paths: Sequence[str],
+               segment_paths: Sequence[str]):
+        """ Remember the files as they are now, once applied to DATA
+        """
+        self.snapshot = [signature(p) for p in snapshot_paths]
+        self.offsets = {}
+        for file_path in segment_paths:
+            sig = signature(file_path)
+            if sig is not None:
+                self.offsets[sig[0]] = sig[2]
+
+    @contextmanager
+    def _hold(self, operation: int) -> Iterator[None]:
+        """ Take the in-process lock, then flock the lock file once
+        """
+        with self._lock:
+            if self._depth == 0:
+                self._file = open(self.lock_path, 'ab')
+                fcntl.flock(self._file.fileno(), operation)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                    self._file.close()
+                    self._file = None
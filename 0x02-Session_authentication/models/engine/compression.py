@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+""" Compression module
+"""
+from os import fsync, getenv
+from typing import BinaryIO, Optional, TextIO, Union
+import gzip
+import io
+import time
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+CODECS = ("none", "gzip", "zstd")
+DEFAULT_LEVELS = {"none": 0, "gzip": 6, "zstd": 3}
+
+
+def codec() -> str:
+    """ Codec of the files written, from MODEL_COMPRESSION
+    """
+    name = getenv("MODEL_COMPRESSION", "none")
+    if name not in CODECS:
+        raise ValueError("unknown MODEL_COMPRESSION {!r}".format(name))
+    if name == "zstd" and zstandard is None:
+        raise ValueError("MODEL_COMPRESSION=zstd needs the zstandard package")
+    return name
+
+
+def level(name: str) -> int:
+    """ Compression level of a codec, from MODEL_COMPRESSION_LEVEL
+    """
+    value = getenv("MODEL_COMPRESSION_LEVEL")
+    return DEFAULT_LEVELS[name] if value is None else int(value)
+
+
+class Writer():
+    """ Binary file written through a codec, measuring what it costs
+
+    Closing it flushes the file to disk. `raw_bytes` counts what was
+    written, `compressed_bytes` the size of the file once closed, and
+    `seconds` the time spent in writes.
+    """
+
+    def __init__(self, file: Union[int, str], name: Optional[str] = None,
+                 compress_level: Optional[int] = None):
+        """ Open file (a path or a descriptor) for writing with a codec
+        """
+        self.codec = codec() if name is None else name
+        self.path = file if isinstance(file, str) else None
+        if compress_level is None:
+            compress_level = level(self.codec)
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.seconds = 0.0
+        self._raw = open(file, 'wb')
+        if self.codec == "gzip":
+            self._f = gzip.GzipFile(fileobj=self._raw, mode='wb',
+                                    compresslevel=compress_level, mtime=0)
+        elif self.codec == "zstd":
+            self._f = zstandard.ZstdCompressor(
+                level=compress_level).stream_writer(self._raw, closefd=False)
+        else:
+            self._f = self._raw
+
+    def write(self, data: bytes):
+        """ Compress and write data
+        """
+        start = time.perf_counter()
+        self._f.write(data)
+        self.seconds += time.perf_counter() - start
+        self.raw_bytes += len(data)
+
+    def close(self):
+        """ End the compressed stream, sync and close the file
+        """
+        start = time.perf_counter()
+        if self._f is not self._raw:
+            self._f.close()
+        self.compressed_bytes = self._raw.tell()
+        self._raw.flush()
+        fsync(self._raw.fileno())
+        self._raw.close()
+        self.seconds += time.perf_counter() - start
+
+    def stats(self) -> dict:
+        """ Codec, sizes and time of what was written
+        """
+        return {
+            "codec": self.codec,
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "seconds": self.seconds,
+        }
+
+    def __enter__(self) -> "Writer":
+        """ Use the writer as a context manager
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """ Close the writer
+        """
+        self.close()
+
+
+def open_read(file_path: str) -> BinaryIO:
+    """ Binary reader of a file, decompressed by the codec its magic names
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(len(ZSTD_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(file_path, 'rb')
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("{} is zstd compressed; install the zstandard "
+                             "package to read it".format(file_path))
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            open(file_path, 'rb'), closefd=True))
+    return open(file_path, 'rb')
+
+
+def open_text(file_path: str) -> TextIO:
+    """ UTF-8 text reader of a file, compressed or not
+    """
+    return io.TextIOWrapper(open_read(file_path), encoding="utf-8")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+""" Durable file replacement module
+
+Files are written to a temp file next to their target, flushed and
+synced, then renamed over it, and the directory is synced last: after
+a crash the target holds either its old or its new content, never a
+torn file.
+"""
+from contextlib import contextmanager
+from os import O_RDONLY, close, fsync, open as os_open, remove, replace
+from tempfile import mkstemp
+from typing import Dict, Iterator, Optional
+from models.engine.compression import Writer
+
+
+def sync_directory(directory: str = "."):
+    """ Flush a directory's entries, so renames and removals in it last
+    """
+    fd = os_open(directory, O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        close(fd)
+
+
+@contextmanager
+def temp_writer(prefix: str, name: Optional[str] = None,
+                compress_level: Optional[int] = None) -> Iterator[Writer]:
+    """ Writer on a new temp file in the current directory
+
+    The file is synced when the block ends and removed if it raises; its
+    path is the writer's `path`. name and compress_level pick the codec,
+    as for Writer.
+    """
+    fd, tmp_path = mkstemp(prefix=prefix, dir=".")
+    close(fd)
+    try:
+        with Writer(tmp_path, name, compress_level) as f:
+            yield f
+    except BaseException:
+        remove(tmp_path)
+        raise
+
+
+def replace_files(moves: Dict[str, str]):
+    """ Rename synced temp files over their targets, then sync the directory
+
+    moves maps each target path to the temp file replacing it.
+    """
+    for file_path, tmp_path in moves.items():
+        replace(tmp_path, file_path)
+    sync_directory()
+
+
+@contextmanager
+def atomic_writer(file_path: str, prefix: str) -> Iterator[Writer]:
+    """ Writer whose content replaces file_path once the block ends
+
+    file_path is left as it was if the block raises.
+    """
+    with temp_writer(prefix) as f:
+        yield f
+    replace_files({file_path: f.path})
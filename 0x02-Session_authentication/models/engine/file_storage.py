@@ -0,0 +1,896 @@
+#!/usr/bin/env python3
+""" File storage module
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+from typing import Dict, Iterator, List, Optional, Tuple, Type, TypeVar
+from os import getenv, listdir, path, remove
+from threading import Lock, RLock, Thread
+from models.engine.coherence import Coherence
+from models.engine.compression import codec, level, open_text
+from models.engine.durable import replace_files, temp_writer
+from models.engine.journal import Journal
+from models.engine.json_stream import iter_object
+from models.engine.locking import RWLock
+from models.engine.query import Query
+from models.engine.serializer import dumps
+from models.engine.shards import shard_of, snapshot_paths
+from models.engine.snapshot import (FORMATS, binary_path, exists,
+                                    layouts, preferred_path, read_binary,
+                                    write_binary)
+from models.engine.storage import Storage
+from models.engine.write_behind import WriteBehind
+import atexit
+import marshal
+import re
+import sys
+import time
+
+
+JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+LOAD_WORKERS = 8
+ORPHAN_AGE = 600
+RAW_CONVERTED = ("created_at", "updated_at")
+ROW_NAMES = {}
+
+
+class Index():
+    """ Secondary index mapping one attribute value to object IDs
+
+    A value held by a single object maps to its ID rather than to a dict,
+    as most indexed values, such as emails, are unique.
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index
+        """
+        self.attribute = attribute
+        self.buckets = {}
+        self.values = {}
+        self.unindexed = {}
+
+    def add(self, obj_id: str, value):
+        """ Index an object's value, moving it if the value changed
+        """
+        if obj_id in self.values and self.values[obj_id] == value:
+            return
+        self.remove(obj_id)
+        try:
+            bucket = self.buckets.setdefault(value, obj_id)
+        except TypeError:
+            self.unindexed[obj_id] = None
+            return
+        if bucket is not obj_id:
+            if type(bucket) is not dict:
+                bucket = self.buckets[value] = {bucket: None}
+            bucket[obj_id] = None
+        self.values[obj_id] = value
+
+    def remove(self, obj_id: str):
+        """ Drop an object from the index
+        """
+        self.unindexed.pop(obj_id, None)
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        bucket = self.buckets[value]
+        if type(bucket) is not dict:
+            del self.buckets[value]
+            return
+        del bucket[obj_id]
+        if len(bucket) == 1:
+            self.buckets[value] = next(iter(bucket))
+
+    def lookup(self, value) -> Optional[List[str]]:
+        """ IDs of objects that may hold value, None if not indexable
+        """
+        try:
+            bucket = self.buckets.get(value)
+        except TypeError:
+            return None
+        if bucket is None:
+            ids = []
+        elif type(bucket) is dict:
+            ids = list(bucket)
+        else:
+            ids = [bucket]
+        return ids + list(self.unindexed)
+
+
+class FileStorage(Storage):
+    """ Objects held in memory and persisted to .db_<Class>.json files
+
+    Changes rewrite the class file, or are appended to a journal with
+    MODEL_JOURNAL=1 and folded into the file once it grows past
+    MODEL_JOURNAL_MAX_BYTES. MODEL_COHERENCE=1 always uses the journal,
+    so other processes apply its new records instead of reloading.
+    With MODEL_SHARDS=N the file is split in N shards by ID hash, and
+    only the shards holding saved changes are rewritten; save_to_file
+    still rewrites them all. _dirty maps each shard changed since it was
+    last written to the sequence number of its latest change.
+    MODEL_SNAPSHOT_FORMAT=binary writes .bin snapshots instead; loading
+    reads whichever format of a file is newer. Snapshots are compressed
+    with MODEL_COMPRESSION (gzip or zstd, at MODEL_COMPRESSION_LEVEL) and
+    compression_stats sums their raw and written sizes; any codec is
+    detected when reading.
+    """
+
+    def __init__(self):
+        """ Initialize an empty storage, configured from the environment
+
+        The MODEL_* variables are read once, here.
+        """
+        self.shards = max(int(getenv("MODEL_SHARDS", "1")), 1)
+        self.lazy = getenv("MODEL_LAZY_LOAD", "0") == "1"
+        self.snapshot_format = getenv("MODEL_SNAPSHOT_FORMAT", "json")
+        if self.snapshot_format not in FORMATS:
+            raise ValueError("unknown MODEL_SNAPSHOT_FORMAT {!r}".format(
+                self.snapshot_format))
+        self.codec = codec()
+        self.compress_level = level(self.codec)
+        self.coherent = getenv("MODEL_COHERENCE", "0") == "1"
+        self.journaled = getenv("MODEL_JOURNAL", "0") == "1" or self.coherent
+        self.journal_max_bytes = int(
+            getenv("MODEL_JOURNAL_MAX_BYTES", JOURNAL_MAX_BYTES))
+        self.load_stats = {}
+        self.compression_stats = {}
+        self._data = {}
+        self._dirty = {}
+        self._sequence = count(1)
+        self._indexes = {}
+        self._journals = {}
+        self._locks = {}
+        self._writers = {}
+        self._coherence_trackers = {}
+        self._registry_lock = Lock()
+        self._hydrate_lock = Lock()
+        self._compactions = []
+        self._write_behind = None
+        if getenv("MODEL_WRITE_BEHIND", "0") == "1":
+            self._write_behind = WriteBehind(
+                self._commit,
+                float(getenv("MODEL_FLUSH_INTERVAL", "0.1")),
+                int(getenv("MODEL_FLUSH_MAX_DIRTY", "1000")),
+                float(getenv("MODEL_MAX_UNFLUSHED_AGE", "1.0")),
+            )
+            atexit.register(self._write_behind.flush)
+        atexit.register(self.finish_compactions)
+
+    def finish_compactions(self):
+        """ Wait for the background compactions still running
+        """
+        while True:
+            with self._registry_lock:
+                running = [t for t in self._compactions if t.is_alive()]
+                self._compactions[:] = running
+            if not running:
+                return
+            for thread in running:
+                thread.join()
+
+    def load(self, cls: Type):
+        """ Load all objects from file, then replay the journal
+
+        The file is parsed one object at a time. With MODEL_LAZY_LOAD=1
+        objects stay raw rows until a get or search first returns them.
+        Rows take under half the memory of the former dict objects, while
+        built objects save about 40%: the halving needs MODEL_LAZY_LOAD=1.
+        The new objects and indexes are built aside and swapped in at once,
+        so readers never see a half-loaded class.
+        """
+        coherence = self._coherence(cls)
+        if coherence is None:
+            self._load(cls)
+            return
+        with coherence.shared():
+            self._load(cls)
+            coherence.record(*self._files(cls))
+
+    def _load(self, cls: Type):
+        """ Replace the objects of the class with the ones on disk
+
+        Shards are read in parallel; journal records replayed on top mark
+        their shards dirty, as the files do not hold them yet. The journal
+        lock keeps a compaction from replacing the files meanwhile.
+        """
+        s_class = cls.__name__
+        shards = self.shards
+        lazy = self.lazy
+        start = time.perf_counter()
+        objs = {}
+        indexes = self._new_indexes(cls)
+        dirty = {}
+        journal = self._journal(cls)
+        with self._writer(cls), journal.lock:
+            if not journal.compacting:
+                self._remove_orphans(
+                    s_class,
+                    0 if self._coherence(cls) is not None else ORPHAN_AGE)
+            file_paths = [p for p in snapshot_paths(s_class, shards)
+                          if exists(p)]
+            if not file_paths:
+                self._check_layout(s_class, shards)
+            if len(file_paths) > 1:
+                with ThreadPoolExecutor(
+                        min(len(file_paths), LOAD_WORKERS)) as executor:
+                    shard_objs = list(executor.map(
+                        lambda p: self._read_shard(cls, p, lazy), file_paths))
+            else:
+                shard_objs = [self._read_shard(cls, p, lazy)
+                              for p in file_paths]
+            for pairs in shard_objs:
+                for obj_id, obj in pairs:
+                    self._store_one(cls, objs, indexes, obj_id, obj)
+
+            for record in journal.replay():
+                dirty[shard_of(record["id"], shards)] = next(self._sequence)
+                if record["op"] == "save":
+                    self._load_one(cls, objs, indexes, record["id"],
+                                   record["obj"], lazy)
+                elif objs.pop(record["id"], None) is not None:
+                    for index in indexes.values():
+                        index.remove(record["id"])
+            with self._lock(cls).write():
+                self._data[s_class] = objs
+                self._indexes[s_class] = indexes
+                self._dirty[s_class] = dirty
+        self.load_stats[s_class] = {
+            "objects": len(objs),
+            "seconds": time.perf_counter() - start,
+            "lazy": lazy,
+            "shards": len(file_paths),
+        }
+
+    def _read_shard(self, cls: Type, file_path: str,
+                    lazy: bool) -> List[Tuple[str, object]]:
+        """ (id, object) pairs of one snapshot file, raw or hydrated
+
+        The binary snapshot is read instead when it is the newer one; its
+        rows become objects directly, without parsing timestamps.
+        """
+        file_path = preferred_path(file_path)
+        if file_path.endswith(".bin"):
+            names, _, rows = read_binary(file_path)
+            id_index = names.index("id")
+            if lazy:
+                return [(row[id_index], self._pack(cls, dict(zip(names, row))))
+                        for row in rows]
+            return [(row[id_index], cls.from_row(names, row))
+                    for row in rows]
+        with open_text(file_path) as f:
+            return [(obj_id,
+                     self._pack(cls, obj_json) if lazy else cls(**obj_json))
+                    for obj_id, obj_json in iter_object(f)]
+
+    @staticmethod
+    def _remove_orphans(s_class: str, min_age: float):
+        """ Remove the temp files a process that died while dumping left
+
+        Needs the journal lock, so no dump of this process is running.
+        Other processes only dump while holding the lock file, so under
+        it every temp file is an orphan; without it, only the ones older
+        than min_age seconds are.
+        """
+        pattern = re.compile(r"^\.db_{}\.[a-z0-9_]{{8}}$".format(
+            re.escape(s_class)))
+        now = time.time()
+        for name in listdir("."):
+            if pattern.match(name):
+                try:
+                    if now - path.getmtime(name) >= min_age:
+                        remove(name)
+                except FileNotFoundError:
+                    pass
+
+    def _check_layout(self, s_class: str, shards: int):
+        """ Refuse to start empty when the files use another shard count
+        """
+        found = sorted(layouts(s_class))
+        if found:
+            raise ValueError(
+                "{} is stored in {} file(s) but MODEL_SHARDS is {}; convert "
+                "it with `python3 -m models.engine.shards`".format(
+                    s_class, found[0], shards))
+
+    def _load_one(self, cls: Type, objs: dict, indexes: dict, obj_id: str,
+                  obj_json: dict, lazy: bool):
+        """ Store and index one loaded object, raw or hydrated
+        """
+        obj = self._pack(cls, obj_json) if lazy else cls(**obj_json)
+        self._store_one(cls, objs, indexes, obj_id, obj)
+
+    def _store_one(self, cls: Type, objs: dict, indexes: dict, obj_id: str,
+                   obj):
+        """ Store and index one object, raw or hydrated
+
+        A hydrated object shares its ID string with its key in _data.
+        """
+        if type(obj) is not bytes:
+            if obj.id == obj_id:
+                obj.id = obj_id
+            self._intern(obj)
+        objs[obj_id] = obj
+        for attr, index in indexes.items():
+            index.add(obj_id, self._attribute(cls, obj_id, obj, attr, None))
+
+    def _touch(self, cls: Type, obj_id: str):
+        """ Mark the shard of an object dirty; needs the write lock
+        """
+        self._dirty.setdefault(cls.__name__, {})[
+            shard_of(obj_id, self.shards)] = next(self._sequence)
+
+    @staticmethod
+    def _row_names(cls: Type) -> Tuple[str, ...]:
+        """ Attributes held by the raw rows of the class, in order
+        """
+        names = ROW_NAMES.get(cls)
+        if names is None:
+            names = ROW_NAMES[cls] = tuple(
+                name for name in cls.attributes() if name != "id")
+        return names
+
+    def _pack(self, cls: Type, obj_json: dict) -> bytes:
+        """ Raw row of a loaded dict: its values but the ID, in one bytes
+
+        One bytes object costs far less than a dict and its strings, and
+        timestamps are kept as microseconds so rows hydrate without
+        parsing. Rows never leave the process, so marshal is safe here.
+        """
+        values = []
+        for name in self._row_names(cls):
+            value = obj_json.get(name)
+            if name in RAW_CONVERTED and type(value) is not int:
+                value = cls.parse_timestamp(value)
+            values.append(value)
+        return marshal.dumps(tuple(values))
+
+    def _unpack(self, cls: Type, obj_id: str, row: bytes) -> dict:
+        """ Attributes of a raw row, timestamps as microseconds
+        """
+        raw = {"id": obj_id}
+        raw.update(zip(self._row_names(cls), marshal.loads(row)))
+        return raw
+
+    def _build(self, cls: Type, obj_id: str,
+               row: bytes) -> TypeVar('Base'):
+        """ Object of a raw row, without storing it
+        """
+        return cls.from_row(("id",) + self._row_names(cls),
+                            (obj_id,) + marshal.loads(row))
+
+    @staticmethod
+    def _intern(obj: TypeVar('Base')):
+        """ Share the strings of the interned attributes between objects
+        """
+        for name in obj.interned_attributes:
+            value = getattr(obj, name, None)
+            if type(value) is str:
+                shared = sys.intern(value)
+                if shared is not value:
+                    setattr(obj, name, shared)
+
+    def _hydrate(self, cls: Type, obj_id: str) -> Optional[TypeVar('Base')]:
+        """ Object stored under obj_id, built first if still raw
+        """
+        objs = self._data.get(cls.__name__, {})
+        obj = objs.get(obj_id)
+        if type(obj) is bytes:
+            with self._hydrate_lock:
+                obj = objs.get(obj_id)
+                if type(obj) is bytes:
+                    obj = self._build(cls, obj_id, obj)
+                    self._intern(obj)
+                    objs[obj_id] = obj
+        return obj
+
+    def _attribute(self, cls: Type, obj_id: str, obj, name: str,
+                   *default):
+        """ Attribute of an object or of its raw row, without storing it
+        """
+        if type(obj) is bytes:
+            raw = self._unpack(cls, obj_id, obj)
+            if name in raw and name not in RAW_CONVERTED:
+                return raw[name]
+            obj = self._build(cls, obj_id, obj)
+        return getattr(obj, name, *default)
+
+    def _value(self, cls: Type, obj_id: str, name: str, *default):
+        """ Attribute of a stored object, read from its raw row if possible
+        """
+        obj = self._data[cls.__name__][obj_id]
+        if type(obj) is bytes and (name not in cls.attributes() or
+                                   name in RAW_CONVERTED):
+            obj = self._hydrate(cls, obj_id)
+        return self._attribute(cls, obj_id, obj, name, *default)
+
+    def _lock(self, cls: Type) -> RWLock:
+        """ Reader/writer lock guarding the objects of the class
+        """
+        s_class = cls.__name__
+        if self._locks.get(s_class) is None:
+            with self._registry_lock:
+                self._locks.setdefault(s_class, RWLock())
+        return self._locks[s_class]
+
+    def _writer(self, cls: Type) -> Lock:
+        """ Lock ordering the changes of the class with their records
+
+        It is held from the update of _data until the change is recorded,
+        so the file, journal and write-behind buffer see changes in the
+        order _data did.
+        """
+        s_class = cls.__name__
+        if self._writers.get(s_class) is None:
+            with self._registry_lock:
+                self._writers.setdefault(s_class, RLock())
+        return self._writers[s_class]
+
+    def _coherence(self, cls: Type) -> Optional[Coherence]:
+        """ Cross-process tracker of the class, if MODEL_COHERENCE is set
+        """
+        if not self.coherent:
+            return None
+        s_class = cls.__name__
+        if self._coherence_trackers.get(s_class) is None:
+            with self._registry_lock:
+                self._coherence_trackers.setdefault(
+                    s_class, Coherence(".db_{}.lock".format(s_class)))
+        return self._coherence_trackers[s_class]
+
+    def _files(self, cls: Type) -> Tuple[List[str], List[str]]:
+        """ Snapshot files and journal segments of the class
+        """
+        journal = self._journal(cls)
+        return ([p for json_path in snapshot_paths(cls.__name__,
+                                                   self.shards)
+                 for p in (json_path, binary_path(json_path))],
+                [journal.compacting_path, journal.file_path])
+
+    def _sync(self, cls: Type) -> bool:
+        """ Catch up with what other processes wrote to the class files
+
+        A rewritten snapshot reloads the class; new journal records are
+        applied on their own. As coherence mode always journals, reloads
+        only follow compactions and explicit save_to_file calls. Costs a
+        few stat calls when nothing changed.
+        """
+        coherence = self._coherence(cls)
+        if coherence is None or not coherence.changed(*self._files(cls)):
+            return False
+        with coherence.shared():
+            journal = self._journal(cls)
+            journal.refresh()
+            snapshots, segments = self._files(cls)
+            if not coherence.changed(snapshots, segments):
+                return False
+            if coherence.snapshot_changed(snapshots):
+                self._load(cls)
+            else:
+                self._apply(cls, journal.tail(coherence.offsets))
+            coherence.record(snapshots, segments)
+        return True
+
+    def _apply(self, cls: Type, records: List[dict]):
+        """ Apply journal records to the objects in memory
+        """
+        s_class = cls.__name__
+        with self._writer(cls):
+            with self._lock(cls).write():
+                objs = self._data.setdefault(s_class, {})
+                indexes = self._get_indexes(cls)
+                for record in records:
+                    self._touch(cls, record["id"])
+                    if record["op"] == "save":
+                        self._load_one(cls, objs, indexes, record["id"],
+                                       record["obj"], self.lazy)
+                    elif objs.pop(record["id"], None) is not None:
+                        for index in indexes.values():
+                            index.remove(record["id"])
+
+    @contextmanager
+    def _coherent(self, cls: Type) -> Iterator[None]:
+        """ Make a change on top of the latest state of the class files
+
+        Direct writes hold the lock file exclusively until recorded. With
+        write-behind the lock is taken at commit time instead, where the
+        pending records are applied again over whatever was reloaded.
+        """
+        coherence = self._coherence(cls)
+        if coherence is None or self._write_behind is not None:
+            self._sync(cls)
+            yield
+            return
+        with coherence.exclusive():
+            self._sync(cls)
+            yield
+
+    def save_to_file(self, cls: Type):
+        """ Save all objects to file
+        """
+        coherence = self._coherence(cls)
+        if coherence is None:
+            self._save_snapshot(cls, True)
+            return
+        with coherence.exclusive():
+            self._sync(cls)
+            self._save_snapshot(cls, True)
+            coherence.record(*self._files(cls))
+
+    def _save_snapshot(self, cls: Type, full: bool = False):
+        """ Rewrite the dirty shards, or all with full, and drop the journal
+
+        Only save_to_file asks for every shard: objects changed in memory
+        without save() are not in any dirty shard.
+        """
+        journal = self._journal(cls)
+        with journal.lock:
+            objs, dirty = self._snapshot(cls)
+            self._replace_shards(
+                cls, self._dump_shards(cls, objs, dirty, full), dirty)
+            journal.clear()
+
+    def _snapshot(self, cls: Type) -> Tuple[list, Dict[int, int]]:
+        """ Objects of the class and its dirty shards, taken together
+        """
+        with self._lock(cls).read():
+            return (list(self._data.get(cls.__name__, {}).items()),
+                    dict(self._dirty.get(cls.__name__, {})))
+
+    def _dump_shards(self, cls: Type, objs: List[Tuple[str, object]],
+                     dirty: Dict[int, int],
+                     full: bool = False) -> Dict[str, str]:
+        """ Write shards to temp files, by shard path
+
+        Only the dirty or missing shards are written, unless full.
+        """
+        shards = self.shards
+        file_paths = snapshot_paths(cls.__name__, shards)
+        groups = {k: [] for k, file_path in enumerate(file_paths)
+                  if full or k in dirty or not exists(file_path)}
+        for obj_id, obj in objs:
+            group = groups.get(shard_of(obj_id, shards))
+            if group is not None:
+                group.append((obj_id, obj))
+        if self.snapshot_format == "binary":
+            file_paths = [binary_path(p) for p in file_paths]
+        return {file_paths[k]: self._dump_snapshot(cls, group)
+                for k, group in groups.items()}
+
+    def _replace_shards(self, cls: Type, tmp_paths: Dict[str, str],
+                        dirty: Dict[int, int]):
+        """ Move written shards in place, then clear what they now hold
+
+        The temp files were synced when written, and the directory is
+        synced before returning, so callers may then drop the journal
+        segments the shards supersede. A shard stays dirty if it changed
+        again since it was dumped.
+        """
+        replace_files(tmp_paths)
+        for file_path in tmp_paths:
+            if file_path.endswith(".bin"):
+                other = file_path[:-len(".bin")] + ".json"
+            else:
+                other = binary_path(file_path)
+            if path.exists(other):
+                remove(other)
+        with self._lock(cls).write():
+            current = self._dirty.get(cls.__name__, {})
+            for k, sequence in dirty.items():
+                if current.get(k) == sequence:
+                    del current[k]
+
+    def _dump_snapshot(self, cls: Type,
+                       objs: List[Tuple[str, TypeVar('Base')]]) -> str:
+        """ Write (id, object) pairs to a temp file next to the class file
+        """
+        s_class = cls.__name__
+        with temp_writer(".db_{}.".format(s_class), self.codec,
+                         self.compress_level) as f:
+            if self.snapshot_format == "binary":
+                names = cls.attributes()
+                rows = [(self._build(cls, obj_id, obj)
+                         if type(obj) is bytes else obj).to_row()
+                        for obj_id, obj in objs]
+                write_binary(f, names,
+                             [n for n in names if n in RAW_CONVERTED], rows)
+            else:
+                objs_json = {}
+                for obj_id, obj in objs:
+                    if type(obj) is bytes:
+                        objs_json[obj_id] = self._build(
+                            cls, obj_id, obj).to_json(True)
+                    else:
+                        objs_json[obj_id] = obj.to_json(True)
+                f.write(dumps(objs_json))
+        self._count_compression(s_class, f.stats())
+        return f.path
+
+    def _count_compression(self, s_class: str, stats: dict):
+        """ Add the sizes and time of one written file to the class totals
+        """
+        with self._registry_lock:
+            totals = self.compression_stats.setdefault(s_class, {
+                "codec": stats["codec"], "files": 0, "raw_bytes": 0,
+                "compressed_bytes": 0, "seconds": 0.0})
+            totals["codec"] = stats["codec"]
+            totals["files"] += 1
+            for key in ("raw_bytes", "compressed_bytes", "seconds"):
+                totals[key] += stats[key]
+
+    def _journal(self, cls: Type) -> Journal:
+        """ Journal of the class, created on first use
+        """
+        s_class = cls.__name__
+        if self._journals.get(s_class) is None:
+            with self._registry_lock:
+                if self._journals.get(s_class) is None:
+                    self._journals[s_class] = Journal(
+                        ".db_{}.journal".format(s_class))
+        return self._journals[s_class]
+
+    def _persist(self, cls: Type, record: dict) -> bool:
+        """ Record one change, now or in the next write-behind window
+
+        Returns True when the caller should flush the write-behind buffer
+        once it released its locks.
+        """
+        if self._write_behind is not None:
+            return self._write_behind.mark(cls, record["id"], record)
+        self._commit(cls, [record])
+        return False
+
+    def _commit(self, cls: Type, records: List[dict]):
+        """ Durably record changes, under the lock file in coherence mode
+        """
+        coherence = self._coherence(cls)
+        if coherence is None:
+            self._write(cls, records)
+            return
+        with coherence.exclusive():
+            if self._sync(cls) or self._write_behind is not None:
+                self._apply(cls, records)
+            self._write(cls, records)
+            coherence.record(*self._files(cls))
+
+    def _write(self, cls: Type, records: List[dict]):
+        """ Durably record changes, in the journal or by rewriting the file
+
+        Compaction runs in the background, or inline in coherence mode so
+        the snapshot is replaced while the lock file is still held.
+        """
+        if not self.journaled:
+            self._save_snapshot(cls)
+            return
+        journal = self._journal(cls)
+        journal.append(records)
+        if journal.size() <= self.journal_max_bytes:
+            return
+        with journal.lock:
+            if not journal.rotate():
+                return
+            objs, dirty = self._snapshot(cls)
+            args = (cls, objs, dirty, journal.generation)
+        if self._coherence(cls) is not None:
+            self._compact(*args)
+            return
+        thread = Thread(target=self._compact, args=args, daemon=True)
+        with self._registry_lock:
+            self._compactions[:] = [
+                t for t in self._compactions if t.is_alive()]
+            self._compactions.append(thread)
+        thread.start()
+
+    def flush(self):
+        """ Commit every change still waiting in the write-behind buffer
+        """
+        if self._write_behind is not None:
+            self._write_behind.flush()
+
+    def _compact(self, cls: Type, objs: List[Tuple[str, TypeVar('Base')]],
+                 dirty: Dict[int, int], generation: int):
+        """ Fold the rotated journal segment into the dirty shards
+
+        On failure the segment stays for the next rotation to fold in.
+        """
+        journal = self._journal(cls)
+        try:
+            tmp_paths = self._dump_shards(cls, objs, dirty)
+        except BaseException:
+            journal.abandon()
+            raise
+        with journal.lock:
+            if journal.generation != generation:
+                for tmp_path in tmp_paths.values():
+                    remove(tmp_path)
+                return
+            self._replace_shards(cls, tmp_paths, dirty)
+            journal.compacted()
+
+    def save(self, obj: TypeVar('Base')):
+        """ Store one object and record the change
+        """
+        cls = obj.__class__
+        self._intern(obj)
+        with self._coherent(cls), self._writer(cls):
+            with self._lock(cls).write():
+                obj.updated_at = datetime.utcnow()
+                self._data.setdefault(cls.__name__, {})[obj.id] = obj
+                self._touch(cls, obj.id)
+                self._index(obj)
+                record = {
+                    "op": "save", "id": obj.id, "obj": obj.to_json(True)
+                }
+            overdue = self._persist(cls, record)
+        if overdue:
+            self.flush()
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one object and record the change
+        """
+        cls = obj.__class__
+        with self._coherent(cls), self._writer(cls):
+            with self._lock(cls).write():
+                objs = self._data.get(cls.__name__, {})
+                if objs.pop(obj.id, None) is None:
+                    return
+                self._touch(cls, obj.id)
+                for index in self._get_indexes(cls).values():
+                    index.remove(obj.id)
+            overdue = self._persist(cls, {"op": "remove", "id": obj.id})
+        if overdue:
+            self.flush()
+
+    def _new_indexes(self, cls: Type) -> dict:
+        """ Empty indexes for every indexed attribute of the class
+        """
+        return {attr: Index(attr) for attr in cls.indexed_attributes}
+
+    def _get_indexes(self, cls: Type) -> dict:
+        """ Indexes of the class, created on first use
+        """
+        s_class = cls.__name__
+        if self._indexes.get(s_class) is None:
+            with self._registry_lock:
+                if self._indexes.get(s_class) is None:
+                    indexes = self._new_indexes(cls)
+                    for obj_id in list(self._data.get(s_class, {})):
+                        for attr, index in indexes.items():
+                            index.add(obj_id,
+                                      self._value(cls, obj_id, attr, None))
+                    self._indexes[s_class] = indexes
+        return self._indexes[s_class]
+
+    def changed(self, obj: TypeVar('Base'), name: str):
+        """ Move a stored object to the index entry of its new value
+
+        Objects not stored yet, such as the ones being built, are skipped
+        without taking the lock.
+        """
+        cls = obj.__class__
+        objs = self._data.get(cls.__name__)
+        obj_id = getattr(obj, "id", None)
+        if objs is None or objs.get(obj_id) is not obj:
+            return
+        with self._lock(cls).write():
+            index = self._get_indexes(cls).get(name)
+            if index is not None and objs.get(obj_id) is obj:
+                index.add(obj_id, getattr(obj, name, None))
+
+    def _index(self, obj: TypeVar('Base')):
+        """ Add or refresh an object in the indexes of its class
+        """
+        for attr, index in self._get_indexes(obj.__class__).items():
+            index.add(obj.id, getattr(obj, attr, None))
+
+    def count(self, cls: Type) -> int:
+        """ Count all objects
+        """
+        s_class = cls.__name__
+        self._sync(cls)
+        with self._lock(cls).read():
+            return len(self._data.get(s_class, {}))
+
+    def get(self, cls: Type, id: str) -> Optional[TypeVar('Base')]:
+        """ Return one object by ID
+        """
+        self._sync(cls)
+        with self._lock(cls).read():
+            return self._hydrate(cls, id)
+
+    def search(self, cls: Type,
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        """
+        s_class = cls.__name__
+
+        def _search(obj_id):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (self._value(cls, obj_id, k) != v):
+                    return False
+            return True
+
+        self._sync(cls)
+        with self._lock(cls).read():
+            objs = self._data.get(s_class, {})
+            candidates = self._index_candidates(cls, attributes)
+            if candidates is None:
+                candidates = list(objs)
+            return [
+                self._hydrate(cls, obj_id) for obj_id in candidates
+                if obj_id in objs and _search(obj_id)
+            ]
+
+    def query(self, query: Query) -> Iterator[TypeVar('Base')]:
+        """ Objects matching a query, found through the best index
+
+        The candidate IDs are taken under the read lock; objects are then
+        checked one by one without it, so a consumer may save while it
+        iterates and an unordered query stops as soon as its limit is met.
+        """
+        cls = query.cls
+        self._sync(cls)
+        with self._lock(cls).read():
+            objs = self._data.get(cls.__name__, {})
+            candidates = self._query_candidates(cls, query.conditions)
+            if candidates is None:
+                candidates = list(objs)
+        names = query.names()
+
+        def _matching():
+            for obj_id in candidates:
+                obj = objs.get(obj_id)
+                raw = self._unpack(cls, obj_id, obj) \
+                    if type(obj) is bytes else None
+                if raw is not None and all(
+                        n in raw and n not in RAW_CONVERTED for n in names):
+                    if query.matches(raw.get):
+                        obj = self._hydrate(cls, obj_id)
+                        if obj is not None:
+                            yield obj
+                    continue
+                if raw is not None:
+                    obj = self._hydrate(cls, obj_id)
+                if obj is not None and \
+                        query.matches(lambda n: getattr(obj, n, None)):
+                    yield obj
+
+        return query.window(_matching())
+
+    def _query_candidates(self, cls: Type,
+                          conditions: list) -> Optional[List[str]]:
+        """ Smallest list of candidate IDs the indexes give for conditions
+        """
+        indexes = self._get_indexes(cls)
+        best = None
+        for name, op, value in conditions:
+            if name not in indexes or op not in ("==", "in"):
+                continue
+            values = [value] if op == "==" else value
+            ids = {}
+            for v in values:
+                found = indexes[name].lookup(v)
+                if found is None:
+                    break
+                ids.update(dict.fromkeys(found))
+            else:
+                if best is None or len(ids) < len(best):
+                    best = list(ids)
+        return best
+
+    def _index_candidates(self, cls: Type,
+                          attributes: dict) -> Optional[List[str]]:
+        """ Smallest list of candidate IDs the indexes give, if any
+        """
+        indexes = self._get_indexes(cls)
+        best = None
+        for k, v in attributes.items():
+            if k not in indexes:
+                continue
+            ids = indexes[k].lookup(v)
+            if ids is not None and (best is None or len(ids) < len(best)):
+                best = ids
+        return best
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+""" Journal module
+"""
+from os import fstat, fsync, path, remove, rename, stat
+import shutil
+from typing import Dict, Iterator, List
+from models.engine.serializer import dumps
+import json
+import threading
+
+
+def _discard(file_path: str):
+    """ Remove a file, if it still exists
+    """
+    try:
+        remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+class Journal():
+    """ Append-only log of the changes made to one model class
+
+    Each line is a JSON record `{"op": "save", "id": ..., "obj": {...}}`
+    or `{"op": "remove", "id": ...}`. While a compaction runs, the older
+    records live in a `.compacting` segment next to the journal.
+    `compacting` is True while this process compacts; a segment left by
+    an earlier run is folded into the next compaction.
+    """
+
+    def __init__(self, file_path: str):
+        """ Initialize a journal stored at file_path
+        """
+        self.file_path = file_path
+        self.compacting_path = "{}.compacting".format(file_path)
+        self.lock = threading.RLock()
+        self.compacting = False
+        self.generation = 0
+        self._file = None
+
+    def append(self, records: List[dict]):
+        """ Durably append records with a single write
+        """
+        data = b"".join(dumps(record) + b"\n" for record in records)
+        with self.lock:
+            if self._file is None:
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+            fsync(self._file.fileno())
+
+    def size(self) -> int:
+        """ Size in bytes of the active segment
+        """
+        with self.lock:
+            if self._file is not None:
+                return self._file.tell()
+            if path.exists(self.file_path):
+                return path.getsize(self.file_path)
+            return 0
+
+    def replay(self) -> Iterator[dict]:
+        """ Records of the compacting then the active segment, oldest first
+        """
+        for file_path in (self.compacting_path, self.file_path):
+            if not path.exists(file_path):
+                continue
+            with open(file_path, 'r', encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def tail(self, offsets: Dict[int, int]) -> List[dict]:
+        """ Complete records past offsets, keyed by segment inode
+        """
+        records = []
+        for file_path in (self.compacting_path, self.file_path):
+            try:
+                f = open(file_path, 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                f.seek(offsets.get(fstat(f.fileno()).st_ino, 0))
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return records
+
+    def refresh(self):
+        """ Drop a handle to a segment another process moved or removed
+        """
+        with self.lock:
+            if self._file is not None:
+                try:
+                    moved = stat(self.file_path).st_ino != \
+                        fstat(self._file.fileno()).st_ino
+                except FileNotFoundError:
+                    moved = True
+                if moved:
+                    self._close()
+
+    def rotate(self) -> bool:
+        """ Move the active segment aside so it can be compacted
+
+        A compacting segment left by an earlier run gets the active one
+        appended, so the compaction folds both in.
+        """
+        with self.lock:
+            if self.compacting:
+                return False
+            self._close()
+            try:
+                if path.exists(self.compacting_path):
+                    self._merge()
+                else:
+                    rename(self.file_path, self.compacting_path)
+            except FileNotFoundError:
+                pass
+            self.compacting = True
+            return True
+
+    def abandon(self):
+        """ Let a later rotation retry a compaction that failed
+        """
+        with self.lock:
+            self.compacting = False
+
+    def compacted(self):
+        """ Drop the segment a finished compaction folded in
+        """
+        with self.lock:
+            _discard(self.compacting_path)
+            self.compacting = False
+
+    def clear(self):
+        """ Drop every segment, once a full snapshot supersedes them
+        """
+        with self.lock:
+            self._close()
+            for file_path in (self.compacting_path, self.file_path):
+                _discard(file_path)
+            self.compacting = False
+            self.generation += 1
+
+    def _merge(self):
+        """ Append the active segment to the compacting one, then drop it
+        """
+        with open(self.file_path, 'rb') as src, \
+                open(self.compacting_path, 'ab+') as dest:
+            end = dest.seek(0, 2)
+            if end > 0:
+                dest.seek(end - 1)
+                if dest.read(1) != b"\n":
+                    dest.write(b"\n")
+            shutil.copyfileobj(src, dest)
+            dest.flush()
+            fsync(dest.fileno())
+        _discard(self.file_path)
+
+    def _open(self):
+        """ Open the active segment, ending any torn last line first
+        """
+        self._file = open(self.file_path, 'ab+')
+        end = self._file.seek(0, 2)
+        if end > 0:
+            self._file.seek(end - 1)
+            if self._file.read(1) != b"\n":
+                self._file.write(b"\n")
+
+    def _close(self):
+        """ Close the active segment
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
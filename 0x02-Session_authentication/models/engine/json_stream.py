@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+""" JSON stream module
+"""
+from typing import Iterator, TextIO, Tuple
+import json
+
+
+CHUNK_SIZE = 1024 * 1024
+WHITESPACE = " \t\n\r"
+
+
+class _Buffer():
+    """ Sliding window over a text stream
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int):
+        """ Initialize an empty window
+        """
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """ Read one more chunk, dropping what was consumed
+        """
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self) -> str:
+        """ Next significant character, without consuming it
+        """
+        while True:
+            while self.pos < len(self.text) and \
+                    self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise ValueError("unexpected end of JSON stream")
+
+    def expect(self, chars: str) -> str:
+        """ Consume one of chars
+        """
+        ch = self.skip_whitespace()
+        if ch not in chars:
+            raise ValueError("expected one of {!r} at {!r}".format(chars, ch))
+        self.pos += 1
+        return ch
+
+    def decode(self, decoder: json.JSONDecoder):
+        """ Decode the next value, reading more until it is complete
+        """
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            if end == len(self.text) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_object(f: TextIO,
+                chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, object]]:
+    """ Yield the (key, value) pairs of a top-level JSON object one by one
+
+    Only one value has to fit in memory at a time, instead of the whole
+    document and its parsed form.
+    """
+    decoder = json.JSONDecoder()
+    buf = _Buffer(f, chunk_size)
+    if not buf.fill():
+        return
+    buf.expect("{")
+    if buf.skip_whitespace() == "}":
+        return
+    while True:
+        key = buf.decode(decoder)
+        buf.expect(":")
+        value = buf.decode(decoder)
+        yield key, value
+        if buf.expect(",}") == "}":
+            return
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+""" Query module
+"""
+from itertools import islice
+from typing import (Any, Callable, Iterable, Iterator, List, Optional, Tuple,
+                    Type, TypeVar)
+import heapq
+import operator
+
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda a, b: a in b,
+    "startswith": lambda a, b: type(a) is str and a.startswith(b),
+}
+SELECTIVITY = {"==": 0, "in": 1, "startswith": 2, "<": 3, "<=": 3, ">": 3,
+               ">=": 3, "!=": 4}
+
+
+class SortKey():
+    """ Sort key over several attributes, each ascending or descending
+
+    None sorts before any value when ascending, after when descending.
+    """
+
+    __slots__ = ("values", "descending")
+
+    def __init__(self, values: Tuple, descending: Tuple[bool, ...]):
+        """ Initialize a key from attribute values and their directions
+        """
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other: "SortKey") -> bool:
+        """ Compare attribute by attribute
+        """
+        for a, b, desc in zip(self.values, other.values, self.descending):
+            if a == b:
+                continue
+            if a is None or b is None:
+                return (a is None) != desc
+            return (a > b) if desc else (a < b)
+        return False
+
+
+class Query():
+    """ Lazy query over the objects of a model class
+
+    Built by chaining `where`, `order_by`, `limit` and `offset`, each
+    returning a new query; nothing runs until the query is iterated.
+
+        User.query().where("email", "startswith", "bob") \\
+            .order_by("-created_at").limit(20)
+    """
+
+    def __init__(self, cls: Type, storage):
+        """ Initialize a query matching every object of cls
+        """
+        self.cls = cls
+        self.storage = storage
+        self.conditions: List[Tuple[str, str, Any]] = []
+        self.order: List[Tuple[str, bool]] = []
+        self.limit_count: Optional[int] = None
+        self.offset_count = 0
+
+    def where(self, name: str, op: str, value) -> "Query":
+        """ Keep objects whose attribute `name` satisfies `op` value
+        """
+        if op not in OPERATORS:
+            raise ValueError("unknown operator {!r}".format(op))
+        query = self._copy()
+        query.conditions.append((name, op, value))
+        query.conditions.sort(key=lambda c: SELECTIVITY[c[1]])
+        return query
+
+    def order_by(self, *names: str) -> "Query":
+        """ Sort by attributes, descending when prefixed with '-'
+        """
+        query = self._copy()
+        query.order = [(n.lstrip("-"), n.startswith("-")) for n in names]
+        return query
+
+    def limit(self, count: Optional[int]) -> "Query":
+        """ Stop after count objects
+        """
+        query = self._copy()
+        query.limit_count = count
+        return query
+
+    def offset(self, count: int) -> "Query":
+        """ Skip the first count objects
+        """
+        query = self._copy()
+        query.offset_count = count
+        return query
+
+    def __iter__(self) -> Iterator[TypeVar('Base')]:
+        """ Run the query, yielding objects as they are found
+        """
+        return iter(self.storage.query(self))
+
+    def all(self) -> List[TypeVar('Base')]:
+        """ Every matching object
+        """
+        return list(self)
+
+    def first(self) -> Optional[TypeVar('Base')]:
+        """ First matching object, None if there is none
+        """
+        return next(iter(self.limit(1)), None)
+
+    def names(self) -> List[str]:
+        """ Attributes the conditions read
+        """
+        return [name for name, _, _ in self.conditions]
+
+    def matches(self, get: Callable[[str], Any]) -> bool:
+        """ Whether the attribute values returned by get pass every condition
+
+        Conditions are checked most selective first and a value that
+        cannot be compared, like None against a date, fails its condition.
+        """
+        for name, op, value in self.conditions:
+            try:
+                if not OPERATORS[op](get(name), value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def sort_key(self, obj) -> SortKey:
+        """ Sort key of an object for order_by
+        """
+        return SortKey(tuple(getattr(obj, name, None)
+                             for name, _ in self.order),
+                       tuple(desc for _, desc in self.order))
+
+    def window(self, objs: Iterable, sort: bool = True) -> Iterator:
+        """ Apply order_by, offset and limit to matching objects
+
+        Without an order the objects stream through and iteration stops
+        once the limit is reached. With one, only offset + limit objects
+        are kept in a heap.
+        """
+        start = self.offset_count
+        stop = None if self.limit_count is None else start + self.limit_count
+        if sort and self.order:
+            if stop is None:
+                objs = sorted(objs, key=self.sort_key)
+            else:
+                objs = heapq.nsmallest(stop, objs, key=self.sort_key)
+        return islice(objs, start, stop)
+
+    def _copy(self) -> "Query":
+        """ Shallow copy, so chained calls leave this query unchanged
+        """
+        query = Query(self.cls, self.storage)
+        query.conditions = list(self.conditions)
+        query.order = list(self.order)
+        query.limit_count = self.limit_count
+        query.offset_count = self.offset_count
+        return query
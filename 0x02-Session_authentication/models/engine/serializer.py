@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+""" Serializer module
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Sequence
+import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def format_micros(micros: int) -> str:
+    """ Format microseconds since the epoch like TIMESTAMP_FORMAT
+    """
+    return (EPOCH + timedelta(seconds=micros // 1000000)).isoformat()
+
+
+def compile_serializer(attributes: Sequence[str],
+                       timestamps: Dict[str, str],
+                       for_serialization: bool,
+                       timestamp_format: str) -> Callable[[object], dict]:
+    """ Build the to_json function of a class from its attribute list
+
+    timestamps maps attribute names to the slots holding them as
+    microseconds. Other attributes keep the generic datetime check, so
+    the result matches Base.to_json value for value. The function raises
+    AttributeError when an attribute was never set.
+    """
+    lines = ["def to_json(self):", "    result = {}"]
+    for name in attributes:
+        if not for_serialization and name[0] == '_':
+            continue
+        if name in timestamps:
+            lines.append("    result[{!r}] = format_micros(self.{})".format(
+                name, timestamps[name]))
+            continue
+        lines.append("    value = self.{}".format(name))
+        lines.append("    if type(value) is datetime:")
+        lines.append("        value = value.strftime(TIMESTAMP_FORMAT)")
+        lines.append("    result[{!r}] = value".format(name))
+    lines.append("    return result")
+    namespace = {
+        "datetime": datetime,
+        "format_micros": format_micros,
+        "TIMESTAMP_FORMAT": timestamp_format,
+    }
+    exec("\n".join(lines), namespace)
+    return namespace["to_json"]
+
+
+def compile_loader(cls: type, slots: Sequence[Optional[str]],
+                   missing: Dict[str, Optional[Callable[[], object]]]
+                   ) -> Callable[[tuple], object]:
+    """ Build a function making an object of cls from a row of values
+
+    slots names the slot receiving each value of the row, None to drop
+    it. Slots in missing are set by calling their default, or to None.
+    __init__ is not called, so timestamps must already be microseconds.
+    """
+    targets = ", ".join("obj." + slot if slot else "_" for slot in slots)
+    lines = ["def load(row):", "    obj = new(cls)",
+             "    {}, = row".format(targets)]
+    namespace = {"new": object.__new__, "cls": cls}
+    for i, (slot, default) in enumerate(missing.items()):
+        if default is None:
+            lines.append("    obj.{} = None".format(slot))
+        else:
+            namespace["default_{}".format(i)] = default
+            lines.append("    obj.{} = default_{}()".format(slot, i))
+    lines.append("    return obj")
+    exec("\n".join(lines), namespace)
+    return namespace["load"]
+
+
+def dumps(obj) -> bytes:
+    """ Encode to JSON with orjson when installed, else the json module
+
+    Both give the same bytes: compact separators and raw UTF-8.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+""" Convert the files of a model class between single and sharded layouts
+
+    python3 -m models.engine.shards split User 8
+    python3 -m models.engine.shards merge User
+
+Run it while no process uses the class files. The journal does not
+depend on the layout and is left as is. Shards are written as JSON,
+with the MODEL_COMPRESSION codec; convert them with
+models.engine.snapshot afterwards if needed.
+"""
+from os import path, remove
+from typing import List
+from models.engine.durable import atomic_writer
+from models.engine.serializer import dumps
+from models.engine.snapshot import (binary_path, iter_snapshot, layouts,
+                                    preferred_path)
+import argparse
+import sys
+import zlib
+
+
+def shard_of(obj_id: str, shards: int) -> int:
+    """ Shard holding an object ID, stable across processes and runs
+    """
+    if shards <= 1:
+        return 0
+    return zlib.crc32(obj_id.encode("utf-8")) % shards
+
+
+def snapshot_paths(s_class: str, shards: int) -> List[str]:
+    """ Snapshot files of a class, one per shard
+    """
+    if shards <= 1:
+        return [".db_{}.json".format(s_class)]
+    return [".db_{}.{}-of-{}.json".format(s_class, k, shards)
+            for k in range(shards)]
+
+
+def migrate(s_class: str, shards: int) -> int:
+    """ Rewrite every snapshot file of a class into `shards` files
+
+    The new files are in place before the old ones are removed. Returns
+    the number of objects moved.
+    """
+    objs = {}
+    found = layouts(s_class)
+    for file_paths in found.values():
+        for file_path in file_paths:
+            objs.update(iter_snapshot(preferred_path(file_path)))
+
+    groups = [{} for _ in range(max(shards, 1))]
+    for obj_id, obj in objs.items():
+        groups[shard_of(obj_id, shards)][obj_id] = obj
+    targets = snapshot_paths(s_class, shards)
+    for file_path, group in zip(targets, groups):
+        with atomic_writer(file_path, ".db_{}.".format(s_class)) as f:
+            f.write(dumps(group))
+    for file_paths in found.values():
+        for file_path in file_paths:
+            stale = [binary_path(file_path)]
+            if file_path not in targets:
+                stale.append(file_path)
+            for stale_path in stale:
+                if path.exists(stale_path):
+                    remove(stale_path)
+    return len(objs)
+
+
+def main(argv: List[str] = None):
+    """ Split or merge the files of a class from the command line
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    split = commands.add_parser("split", help="spread a class over shards")
+    split.add_argument("model", help="model class name, e.g. User")
+    split.add_argument("shards", type=int, help="number of shard files")
+    merge = commands.add_parser("merge", help="gather a class in one file")
+    merge.add_argument("model", help="model class name, e.g. User")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    shards = args.shards if args.command == "split" else 1
+    if shards < 1:
+        parser.error("shards must be at least 1")
+    count = migrate(args.model, shards)
+    print("{}: {} objects in {} file(s)".format(args.model, count, shards))
+
+
+if __name__ == "__main__":
+    main()
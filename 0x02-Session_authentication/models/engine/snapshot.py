@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+""" Convert the snapshot files of a model class between JSON and binary
+
+    python3 -m models.engine.snapshot User --to binary
+    python3 -m models.engine.snapshot User --to json
+
+A binary snapshot is the magic header followed by a pickle, at a fixed
+protocol, of {"attributes": names, "timestamps": names, "rows": [tuple,
+...]}: one tuple of values per object, timestamps as microseconds since
+the epoch. Only builtin values are unpickled.
+Files are written with the MODEL_COMPRESSION codec and read whatever
+codec they were written with.
+"""
+from datetime import datetime
+from os import listdir, path, remove
+from typing import BinaryIO, Dict, Iterator, List, Sequence, Tuple
+from models.engine.compression import open_read, open_text
+from models.engine.durable import atomic_writer
+from models.engine.json_stream import iter_object
+from models.engine.serializer import (EPOCH, MICROSECOND, TIMESTAMP_FORMAT,
+                                      dumps, format_micros)
+import argparse
+import io
+import pickle
+import re
+import sys
+
+
+MAGIC = b"MDLSNAP2"
+PICKLE_PROTOCOL = 4
+FORMATS = ("json", "binary")
+TIMESTAMPS = ("created_at", "updated_at")
+
+
+def binary_path(json_path: str) -> str:
+    """ Binary counterpart of a .json snapshot path
+    """
+    return json_path[:-len(".json")] + ".bin"
+
+
+def preferred_path(json_path: str) -> str:
+    """ Snapshot to read for a path: the binary one when it is newer
+    """
+    bin_path = binary_path(json_path)
+    if not path.exists(bin_path):
+        return json_path
+    if path.exists(json_path) and \
+            path.getmtime(json_path) > path.getmtime(bin_path):
+        return json_path
+    return bin_path
+
+
+def exists(json_path: str) -> bool:
+    """ Whether a snapshot exists for a path, in either format
+    """
+    return path.exists(json_path) or path.exists(binary_path(json_path))
+
+
+class RowUnpickler(pickle.Unpickler):
+    """ Unpickler of snapshot payloads, refusing anything but builtins
+    """
+
+    def find_class(self, module: str, name: str):
+        """ Refuse every class, so a file cannot run code when loaded
+        """
+        raise pickle.UnpicklingError(
+            "{}.{} is not allowed in a snapshot".format(module, name))
+
+
+def write_binary(f: BinaryIO, names: Sequence[str],
+                 timestamps: Sequence[str], rows: List[tuple]):
+    """ Write rows of attribute values as a binary snapshot to a file
+    """
+    payload = {"attributes": tuple(names), "timestamps": tuple(timestamps),
+               "rows": rows}
+    f.write(MAGIC)
+    pickle.dump(payload, f, PICKLE_PROTOCOL)
+
+
+def read_binary(file_path: str) -> Tuple[Tuple[str, ...], Tuple[str, ...],
+                                         List[tuple]]:
+    """ Attribute names, timestamp names and rows of a binary snapshot
+    """
+    with open_read(file_path) as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("{} is not a binary snapshot".format(file_path))
+    payload = RowUnpickler(io.BytesIO(memoryview(data)[len(MAGIC):])).load()
+    return payload["attributes"], payload["timestamps"], payload["rows"]
+
+
+def iter_snapshot(file_path: str) -> Iterator[Tuple[str, dict]]:
+    """ (id, JSON dictionary) pairs of a snapshot in either format
+    """
+    if file_path.endswith(".bin"):
+        names, timestamps, rows = read_binary(file_path)
+        id_index = names.index("id")
+        for row in rows:
+            obj = dict(zip(names, row))
+            for name in timestamps:
+                if obj[name] is not None:
+                    obj[name] = format_micros(obj[name])
+            yield row[id_index], obj
+        return
+    with open_text(file_path) as f:
+        yield from iter_object(f)
+
+
+def to_rows(objs: List[dict]) -> Tuple[List[str], List[str], List[tuple]]:
+    """ Names, timestamp names and rows of JSON dictionaries
+    """
+    names = {}
+    for obj in objs:
+        names.update(dict.fromkeys(obj))
+    names = list(names)
+    timestamps = [name for name in names if name in TIMESTAMPS]
+    rows = []
+    for obj in objs:
+        obj = dict(obj)
+        for name in timestamps:
+            if obj.get(name) is not None:
+                moment = datetime.strptime(obj[name], TIMESTAMP_FORMAT)
+                obj[name] = (moment - EPOCH) // MICROSECOND
+        rows.append(tuple(obj.get(name) for name in names))
+    return names, timestamps, rows
+
+
+def layouts(s_class: str, directory: str = ".") -> Dict[int, List[str]]:
+    """ Snapshot paths of a class found on disk, by shard count
+
+    Paths are given with a .json extension whichever format exists.
+    """
+    pattern = re.compile(r"^\.db_{}(?:\.(\d+)-of-(\d+))?\.(?:json|bin)$"
+                         .format(re.escape(s_class)))
+    found = {}
+    for name in sorted(listdir(directory)):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        shards = 1 if match.group(2) is None else int(match.group(2))
+        json_path = re.sub(r"\.bin$", ".json", name)
+        if json_path not in found.setdefault(shards, []):
+            found[shards].append(json_path)
+    return found
+
+
+def convert(s_class: str, target: str) -> int:
+    """ Rewrite every snapshot of a class in the target format
+
+    Returns the number of files converted.
+    """
+    converted = 0
+    for json_paths in layouts(s_class).values():
+        for json_path in json_paths:
+            source = preferred_path(json_path)
+            objs = dict(iter_snapshot(source))
+            dest = json_path if target == "json" else binary_path(json_path)
+            with atomic_writer(dest, ".db_{}.".format(s_class)) as f:
+                if target == "json":
+                    f.write(dumps(objs))
+                else:
+                    write_binary(f, *to_rows(list(objs.values())))
+            other = binary_path(json_path) if target == "json" else json_path
+            if path.exists(other):
+                remove(other)
+            converted += 1
+    return converted
+
+
+def main(argv: List[str] = None):
+    """ Convert the snapshots of a class from the command line
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument("model", help="model class name, e.g. User")
+    parser.add_argument("--to", choices=FORMATS, required=True,
+                        help="format to write")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    count = convert(args.model, args.to)
+    print("{}: {} file(s) written as {}".format(args.model, count, args.to))
+
+
+if __name__ == "__main__":
+    main()
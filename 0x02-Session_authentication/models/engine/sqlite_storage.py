@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+"""
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple, Type, TypeVar
+from models.engine.query import Query
+from models.engine.storage import Storage
+import sqlite3
+import threading
+
+
+PUSHED_TYPES = (str, int, float, type(None))
+MAX_CHAR = chr(0x10FFFF)
+UNPUSHED = object()
+
+
+def quote(name: str) -> str:
+    """ Quote an SQL identifier
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class SQLiteStorage(Storage):
+    """ Objects stored in one SQLite database, a table per model class
+
+    The database runs in WAL mode, so readers do not wait for the writer.
+    Columns are the serialized attributes of the class, with an index per
+    indexed attribute, and search runs as a WHERE clause. Each thread has
+    its own connection.
+    """
+
+    def __init__(self, db_path: str):
+        """ Initialize a storage using the database at db_path
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def load(self, cls: Type):
+        """ Create the table of a class; rows are read on demand
+        """
+        self._table(cls)
+
+    def save_to_file(self, cls: Type):
+        """ Move committed changes from the WAL into the database file
+        """
+        self._table(cls)
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update one object
+
+        The write lock of the database is taken before updated_at is
+        stamped, so concurrent saves are stored in the order of their
+        timestamps.
+        """
+        cls = obj.__class__
+        table, columns = self._table(cls)
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            obj.updated_at = datetime.utcnow()
+            row = obj.to_json(True)
+            connection.execute(
+                "INSERT INTO {} ({}) VALUES ({}) "
+                "ON CONFLICT(\"id\") DO UPDATE SET {}".format(
+                    table,
+                    ", ".join(quote(c) for c in columns),
+                    ", ".join("?" for _ in columns),
+                    ", ".join("{0} = excluded.{0}".format(quote(c))
+                              for c in columns if c != "id")),
+                [row.get(c) for c in columns])
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one object
+        """
+        table, _ = self._table(obj.__class__)
+        self._connection().execute(
+            "DELETE FROM {} WHERE \"id\" = ?".format(table), (obj.id,))
+
+    def count(self, cls: Type) -> int:
+        """ Number of rows of the class table
+        """
+        table, _ = self._table(cls)
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+
+    def get(self, cls: Type, id: str) -> Optional[TypeVar('Base')]:
+        """ One object by ID, None if missing
+        """
+        table, _ = self._table(cls)
+        row = self._connection().execute(
+            "SELECT * FROM {} WHERE \"id\" = ?".format(table),
+            (id,)).fetchone()
+        return None if row is None else cls(**dict(row))
+
+    def search(self, cls: Type,
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects with matching attributes, filtered by SQLite
+        """
+        query = Query(cls, self)
+        for k, v in attributes.items():
+            query = query.where(k, "==", v)
+        return list(self.query(query))
+
+    def query(self, query: Query) -> Iterator[TypeVar('Base')]:
+        """ Objects matching a query, read lazily from a cursor
+
+        Conditions, order and limit run in SQLite when it compares values
+        the way Python would; what is left is applied to the built objects.
+        """
+        cls = query.cls
+        table, columns = self._table(cls)
+        where, params = [], []
+        rest = Query(cls, self)
+        for condition in query.conditions:
+            sql = self._condition(columns, *condition)
+            if sql is None:
+                rest.conditions.append(condition)
+            else:
+                where.append(sql[0])
+                params.extend(sql[1])
+        sorted_in_sql = all(name in columns for name, _ in query.order)
+
+        sql = "SELECT * FROM {}".format(table)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        order = ["rowid"]
+        if sorted_in_sql:
+            order[:0] = ["{} {}".format(quote(name), "DESC" if desc else "ASC")
+                         for name, desc in query.order]
+        sql += " ORDER BY " + ", ".join(order)
+        if not rest.conditions and sorted_in_sql:
+            if query.limit_count is not None or query.offset_count:
+                sql += " LIMIT ? OFFSET ?"
+                params.append(-1 if query.limit_count is None
+                              else query.limit_count)
+                params.append(query.offset_count)
+            rows = self._connection().execute(sql, params)
+            return (cls(**dict(row)) for row in rows)
+
+        rows = self._connection().execute(sql, params)
+        objs = (obj for obj in (cls(**dict(row)) for row in rows)
+                if rest.matches(lambda name: getattr(obj, name, None)))
+        return query.window(objs, sort=not sorted_in_sql)
+
+    def _condition(self, columns: Tuple[str, ...], name: str, op: str,
+                   value) -> Optional[Tuple[str, list]]:
+        """ SQL and parameters of one condition, None to check it in Python
+        """
+        if name not in columns:
+            return None
+        column = quote(name)
+        if op == "in":
+            try:
+                values = [self._param(v) for v in value]
+            except TypeError:
+                return None
+            if any(v is UNPUSHED or v is None for v in values):
+                return None
+            return ("{} IN ({})".format(
+                column, ", ".join("?" for _ in values)), values)
+        if op == "startswith":
+            if type(value) is not str or value.endswith(MAX_CHAR):
+                return None
+            if not value:
+                return "typeof({}) = 'text'".format(column), []
+            upper = value[:-1] + chr(ord(value[-1]) + 1)
+            return ("{0} >= ? AND {0} < ?".format(column), [value, upper])
+        param = self._param(value)
+        if param is UNPUSHED:
+            return None
+        if op == "==":
+            return "{} IS ?".format(column), [param]
+        if op == "!=":
+            return "{} IS NOT ?".format(column), [param]
+        return "{} {} ?".format(column, op), [param]
+
+    @staticmethod
+    def _param(value):
+        """ Value as stored in a column, UNPUSHED if it is not comparable
+        """
+        if type(value) in PUSHED_TYPES:
+            return value
+        if type(value) is datetime and value.tzinfo is None and \
+                value.microsecond == 0:
+            return value.isoformat()
+        return UNPUSHED
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread, opened on first use
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _table(self, cls: Type) -> Tuple[str, Tuple[str, ...]]:
+        """ Quoted table name and columns of a class, created on first use
+
+        Columns added to the class later are added to the table as well.
+        """
+        s_class = cls.__name__
+        columns = self._columns.get(s_class)
+        if columns is not None:
+            return quote(s_class), columns
+        with self._lock:
+            columns = cls.attributes()
+            conn = self._connection()
+            conn.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(
+                quote(s_class),
+                ", ".join(quote(c) + (" TEXT PRIMARY KEY" if c == "id"
+                                      else "") for c in columns)))
+            existing = {row[1] for row in conn.execute(
+                "PRAGMA table_info({})".format(quote(s_class)))}
+            for c in columns:
+                if c not in existing:
+                    conn.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                        quote(s_class), quote(c)))
+            for attr in cls.indexed_attributes:
+                conn.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                    quote("ix_{}_{}".format(s_class, attr)),
+                    quote(s_class), quote(attr)))
+            self._columns[s_class] = columns
+        return quote(s_class), columns
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+""" Storage module
+"""
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional, Type, TypeVar
+from models.engine.query import Query
+
+
+class Storage(ABC):
+    """ Interface of the backends persisting model objects
+
+    Every method takes the model class (or an instance of it), so one
+    backend serves all the models. Base delegates its persistence API
+    to the backend selected by MODEL_STORAGE.
+    """
+
+    @abstractmethod
+    def load(self, cls: Type):
+        """ Load the objects of a class, replacing those in memory
+        """
+
+    @abstractmethod
+    def save_to_file(self, cls: Type):
+        """ Write every object of a class to durable storage
+        """
+
+    @abstractmethod
+    def save(self, obj: TypeVar('Base')):
+        """ Store one object, stamping its updated_at under the lock
+        """
+
+    @abstractmethod
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one object
+        """
+
+    @abstractmethod
+    def count(self, cls: Type) -> int:
+        """ Number of objects of a class
+        """
+
+    @abstractmethod
+    def get(self, cls: Type, id: str) -> Optional[TypeVar('Base')]:
+        """ One object by ID, None if missing
+        """
+
+    @abstractmethod
+    def search(self, cls: Type,
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects whose attributes equal every value of attributes
+        """
+
+    def query(self, query: Query) -> Iterator[TypeVar('Base')]:
+        """ Objects matching a query, by filtering every object in Python
+
+        Backends override it to use their indexes and stop early.
+        """
+        objs = (obj for obj in self.search(query.cls, {})
+                if query.matches(lambda name: getattr(obj, name, None)))
+        return query.window(objs)
+
+    def flush(self):
+        """ Commit every change the backend still buffers
+        """
+
+    def changed(self, obj: TypeVar('Base'), name: str):
+        """ Note that an indexed attribute of an object was assigned
+        """
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+""" Write-behind module
+"""
+from typing import Callable, Dict, Hashable, List, Optional
+import logging
+import threading
+import time
+
+
+class WriteBehind():
+    """ Buffer of pending changes committed in batches by a background thread
+
+    Changes are grouped by key (a model class) and coalesced by object ID,
+    so saving the same object twice in a window commits it once. A window
+    is flushed every `interval` seconds, as soon as `max_dirty` changes
+    are pending, or inline by the writer once the oldest pending change
+    is older than `max_age` seconds: `mark` then returns True, so the
+    writer can flush after releasing its own locks.
+
+    A failed window is logged and kept, with its age, for the next flush.
+    `error` holds the failure until a flush succeeds, and a change still
+    pending after `max_age` makes the writer flush inline and raise it.
+    """
+
+    def __init__(self, commit: Callable[[Hashable, List[dict]], None],
+                 interval: float = 0.1, max_dirty: int = 1000,
+                 max_age: float = 1.0):
+        """ Initialize and start the flushing thread
+        """
+        self.commit = commit
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.max_age = max_age
+        self._dirty: Dict[Hashable, Dict[str, dict]] = {}
+        self._count = 0
+        self._oldest = None
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def mark(self, key: Hashable, obj_id: str, record: dict) -> bool:
+        """ Queue the latest change of an object, True if a flush is due
+        """
+        with self._lock:
+            dirty = self._dirty.setdefault(key, {})
+            dirty.pop(obj_id, None)
+            dirty[obj_id] = record
+            self._count += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            overdue = time.monotonic() - self._oldest > self.max_age
+            full = self._count >= self.max_dirty
+        if full and not overdue:
+            self._wake.set()
+        return overdue
+
+    def flush(self):
+        """ Commit every pending change now
+        """
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+                oldest = self._oldest
+                self._count = 0
+                self._oldest = None
+            pending = list(dirty.items())
+            for i, (key, records) in enumerate(pending):
+                try:
+                    self.commit(key, list(records.values()))
+                except Exception as e:
+                    for key, records in pending[i:]:
+                        self._requeue(key, records, oldest)
+                    self.error = e
+                    raise
+            self.error = None
+
+    def _requeue(self, key: Hashable, records: Dict[str, dict],
+                 oldest: float):
+        """ Put back changes that failed to commit, unless superseded
+
+        They keep the age of the window, so a lasting failure still makes
+        them overdue.
+        """
+        with self._lock:
+            dirty = self._dirty.setdefault(key, {})
+            for obj_id, record in records.items():
+                if obj_id not in dirty:
+                    dirty[obj_id] = record
+                    self._count += 1
+            if self._oldest is None or oldest < self._oldest:
+                self._oldest = oldest
+
+    def _run(self):
+        """ Flush a window at a time until the process exits
+        """
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "write-behind flush failed; changes kept for a retry")
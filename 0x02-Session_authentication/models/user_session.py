@@ -10,6 +10,10 @@ class UserSession(Base):
     UserSession class
     """
 
+    __slots__ = ("user_id", "session_id")
+    indexed_attributes = ("session_id", "user_id")
+    interned_attributes = ("user_id",)
+
     def __init__(self, *args: list, **kwargs: dict):
         """
         Initialize a UserSession instance